@@ -0,0 +1,29 @@
+#!/usr/bin/python
+
+import argparse as argparse
+
+
+parser = argparse.ArgumentParser(
+    description='Gather and process the sector data of several F1TV Data Channel recordings in one run.\n'
+                'Every race is written to its own directory, <output>/<race name>/output/sector_store.')
+
+parser.add_argument('path', metavar='p', type=str, nargs='*', help='videos to process')
+parser.add_argument('-m', '--manifest', type=str, help='JSON manifest of races with per-race config overrides')
+parser.add_argument('-o', '--output', type=str, default="batch", help='directory for the per-race outputs')
+parser.add_argument('-w', '--workers', type=int, help='worker processes shared by all races '
+                                                    '(race_processing.workers by default)')
+parser.add_argument('-s', '--screenshots', help='also save the gathered screenshots of every race',
+                    action='store_true')
+parser.add_argument('-r', '--resume', help='resume every race from its last checkpoint', action='store_true')
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    from src.race.batch import load_manifest, get_batch_races, run_batch
+
+    races = [{"video": path, "name": None, "config": {}} for path in args.path]
+    if args.manifest:
+        races += load_manifest(args.manifest)
+    if len(races) == 0:
+        parser.error("no videos or manifest given")
+
+    run_batch(get_batch_races(races, args.output), args.workers, args.resume, args.screenshots or None)
@@ -0,0 +1,81 @@
+#!/usr/bin/python
+# Compares the per-cell OCR latency of the configured OCR backends.
+# Run from the repository root: python -m benchmarks.ocr_backends [--cells 200]
+
+import argparse
+import random
+import time
+from glob import glob
+
+import cv2
+import numpy as np
+
+from src.race.cell_grid import preprocess_image, extract_cells
+from src.race.ocr import backends
+from src.race.race_settings import RaceSettings
+
+race = RaceSettings()
+res_mul = race.res_mul
+driver_whitelist = race.ocr.driver_whitelist
+sector_whitelist = race.ocr.sector_whitelist
+
+
+def screenshot_cells(limit: int):
+    cells = []
+    for sectors_path in sorted(glob("screenshots/sectors/*.png")):
+        drivers_path = sectors_path.replace("sectors", "drivers")
+        _, sectors, sectors_not_black = extract_cells(cv2.imread(sectors_path), "sectors", res_mul, race.drivers_on_grid)
+        _, drivers, drivers_not_black = extract_cells(cv2.imread(drivers_path), "drivers", res_mul, race.drivers_on_grid)
+        cells += [(cell, sector_whitelist) for cell, not_black in zip(sectors, sectors_not_black) if not_black]
+        cells += [(cell, driver_whitelist) for cell, not_black in zip(drivers, drivers_not_black) if not_black]
+        if len(cells) >= limit:
+            break
+    return cells[:limit]
+
+
+def synthetic_cells(limit: int):
+    cells = []
+    for i in range(limit):
+        sector = i % 4 != 0
+        width = int((70 if sector else 42) * res_mul)
+        text = f"{random.uniform(18, 40):06.3f}" if sector else "".join(random.sample("ABCDEFGHIKLMNOPRSTUVW", 3))
+        cell = np.zeros((int(21 * res_mul), width, 3), np.uint8)
+        cv2.putText(cell, text, (2, int(15 * res_mul)), cv2.FONT_HERSHEY_SIMPLEX, 0.45 * res_mul, (255, 255, 255), 1)
+        cells.append((preprocess_image(cell, 4, contrast=True), sector_whitelist if sector else driver_whitelist))
+    return cells
+
+
+def benchmark(name: str, cells: list):
+    start = time.perf_counter()
+    backend = backends[name](race.ocr)
+    startup = time.perf_counter() - start
+
+    texts, latencies = [], []
+    for cell, whitelist in cells:
+        start = time.perf_counter()
+        texts.append(backend.image_to_string(cell, whitelist).strip())
+        latencies.append(time.perf_counter() - start)
+
+    latencies = np.array(latencies) * 1000
+    print(f"{name:>10}: startup {startup * 1000:8.1f} ms | per cell mean {latencies.mean():7.2f} ms, "
+          f"median {np.median(latencies):7.2f} ms, p95 {np.percentile(latencies, 95):7.2f} ms")
+    return texts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the per-cell latency of the OCR backends.')
+    parser.add_argument('--cells', type=int, default=200, help='number of cells to recognize per backend')
+    parser.add_argument('--synthetic', action='store_true', help='use rendered cells instead of screenshots/')
+    parser.add_argument('--backends', nargs='+', default=list(backends.keys()), help='backends to compare')
+    args = parser.parse_args()
+
+    cells = [] if args.synthetic else screenshot_cells(args.cells)
+    if len(cells) == 0:
+        cells = synthetic_cells(args.cells)
+    print(f"Recognizing {len(cells)} cells per backend")
+
+    results = {name: benchmark(name, cells) for name in args.backends}
+    reference = results[args.backends[0]]
+    for name in args.backends[1:]:
+        agreement = np.mean([a == b for a, b in zip(reference, results[name])])
+        print(f"{name} agrees with {args.backends[0]} on {agreement:.1%} of the cells")
@@ -0,0 +1,67 @@
+#!/usr/bin/python
+# Measures how long the command line scripts and the stage modules take to start, and which heavy
+# dependencies each of them loads.
+# Run from the repository root: python -m benchmarks.startup [--repeats 10]
+
+import argparse
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+heavy_modules = ["pandas", "matplotlib", "seaborn", "scipy", "PIL", "pytesseract", "tesserocr", "cv2", "tqdm"]
+
+commands = {
+    "run_script.py --help": ["run_script.py", "--help"],
+    "batch_script.py --help": ["batch_script.py", "--help"],
+    "live_script.py --help": ["live_script.py", "--help"],
+    "print_sector_stats.py --help": ["print_sector_stats.py", "--help"],
+    "gather stage": ["-c", "import src.race.data_gathering"],
+    "process stage": ["-c", "import src.race.data_processing"],
+    "visualize stage": ["-c", "import src.race.data_visualization"],
+}
+
+
+def run(arguments: list, import_time: bool = False):
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable] + (["-X", "importtime"] if import_time else []) + arguments,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise Exception(f"{' '.join(arguments)} failed:\n{result.stderr}")
+    return elapsed, result.stderr
+
+
+def get_loaded_modules(arguments: list):
+    # Top level packages from -X importtime, with their cumulative import time in ms
+    _, output = run(arguments, import_time=True)
+    loaded = {}
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if cumulative.strip().isdigit() and "." not in name.strip():
+            loaded[name.strip()] = max(loaded.get(name.strip(), 0), int(cumulative) / 1000)
+    return loaded
+
+
+def benchmark(name: str, arguments: list, repeats: int):
+    run(arguments)
+    times = np.array([run(arguments)[0] for _ in range(repeats)]) * 1000
+    loaded = get_loaded_modules(arguments)
+    heavy = [f"{module} ({loaded[module]:.0f} ms)" for module in heavy_modules if module in loaded]
+    print(f"{name:>30}: median {np.median(times):7.1f} ms, min {times.min():7.1f} ms | "
+          f"loads {', '.join(heavy) if heavy else 'no heavy dependencies'}")
+    return np.median(times)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the startup time of the scripts and stages.')
+    parser.add_argument('--repeats', type=int, default=10, help='runs per command')
+    args = parser.parse_args()
+
+    # The interpreter alone, for reference
+    benchmark("python -c pass", ["-c", "pass"], args.repeats)
+    for name, arguments in commands.items():
+        benchmark(name, arguments, args.repeats)
@@ -0,0 +1,278 @@
+#!/usr/bin/python
+# Measures gathering, OCR and end-to-end throughput, the field-level accuracy and how complete the fixed and
+# adaptive sampling schedules are on synthetic races.
+# Run from the repository root: python -m benchmarks.synthetic_race [--resolutions 720 1080] [--minutes 5]
+
+import argparse
+import json
+import os
+import random
+import time
+from multiprocessing import Pool
+
+import cv2
+import numpy as np
+
+import src.race.ocr as ocr
+from src.race.cell_grid import get_tower_geometry, extract_cells
+from src.race.data_gathering import iterate_samples, get_video_samples, stream_screenshots, get_video_fps
+from src.race.data_processing import process_screenshots, parse_drivers, parse_sectors, limit_sector_times
+from src.race.metrics import get_metrics
+from src.race.race_settings import RaceSettings, OCRSettings, merge_config
+from src.race.sector_store import SectorStore
+
+benchmark_dir = "output/benchmark"
+
+
+def render_tower(order: list, shown: dict, res_mul: float, red_flag: bool):
+    # A black frame with the driver column and the S1/S2/S3 grid where the gathering crops them
+    frame = np.zeros((int(720 * res_mul), int(1280 * res_mul), 3), np.uint8)
+    (top, _, left, _), _, sectors_left = get_tower_geometry(res_mul)
+    for row, driver in enumerate(order):
+        baseline = top + int(row * 21 * res_mul) + int(15 * res_mul)
+        cv2.putText(frame, driver, (left + int(2 * res_mul), baseline), cv2.FONT_HERSHEY_DUPLEX, 0.47 * res_mul,
+                    (255, 255, 255), max(1, round(res_mul)))
+        for sector in [1, 2, 3]:
+            if shown[driver][sector] > 0:
+                x = left + sectors_left + int((sector - 1) * 70 * res_mul) + int(4 * res_mul)
+                cv2.putText(frame, f"{shown[driver][sector]:06.3f}", (x, baseline), cv2.FONT_HERSHEY_SIMPLEX,
+                            0.5 * res_mul, (255, 255, 255), round(2 * res_mul))
+    if red_flag:
+        # The banner area is_red_flag looks at
+        cv2.rectangle(frame, (int(285 * res_mul), int(35 * res_mul)), (int(800 * res_mul), int(60 * res_mul)),
+                      (0, 0, 220), -1)
+    return frame
+
+
+def generate_race(path: str, resolution: int, minutes: float, frames_per_second: int = 25, seed: int = 1,
+                  red_flags: int = 0, noise: float = 0):
+    # Writes a race to path and returns its ground truth: every sector time with the frame it appeared on,
+    # the driver order from a frame on (cars behind each other sometimes swap) and the red flag periods
+    rng = random.Random(seed)
+    res_mul = resolution / 720
+    race = RaceSettings()
+    drivers = race.drivers[:race.drivers_on_grid]
+    pace = {driver: [rng.uniform(20, 28), rng.uniform(25, 35), rng.uniform(20, 27)] for driver in drivers}
+    shown = {driver: {1: 0., 2: 0., 3: 0.} for driver in drivers}
+    next_time = {driver: (rng.uniform(0, 30), 1) for driver in drivers}
+    order = list(drivers)
+    total_frames = int(minutes * 60 * frames_per_second)
+    red_flag_frames = sorted((start, start + 30 * frames_per_second) for start in
+                             rng.sample(range(total_frames - 30 * frames_per_second), red_flags))
+    truth = {"resolution": resolution, "frames_per_second": frames_per_second, "frames": total_frames,
+             "times": [], "orders": [[0, list(order)]], "red_flags": red_flag_frames}
+
+    # A few noise patterns are cycled, noise for every frame would make generating slower than processing
+    noise_rng = np.random.default_rng(seed)
+    noise_frames = [noise_rng.normal(0, noise, (int(720 * res_mul), int(1280 * res_mul), 3)).astype(np.int16)
+                    for _ in range(8 if noise > 0 else 0)]
+
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), frames_per_second,
+                             (int(1280 * res_mul), int(720 * res_mul)))
+    frame, red_flag = None, None
+    for frame_index in range(total_frames):
+        seconds = frame_index / frames_per_second
+        changed = frame is None
+        for driver in drivers:
+            due, sector = next_time[driver]
+            if seconds >= due:
+                shown[driver][sector] = round(pace[driver][sector - 1] + rng.uniform(0, 1.5), 3)
+                truth["times"].append([frame_index, driver, sector, shown[driver][sector]])
+                next_time[driver] = (due + shown[driver][sector], sector % 3 + 1)
+                if sector == 3 and order.index(driver) > 0 and rng.random() < 0.1:
+                    position = order.index(driver)
+                    order[position - 1], order[position] = order[position], order[position - 1]
+                    truth["orders"].append([frame_index, list(order)])
+                changed = True
+
+        in_red_flag = any(start <= frame_index < end for start, end in red_flag_frames)
+        if changed or in_red_flag != red_flag:
+            red_flag = in_red_flag
+            frame = render_tower(order, shown, res_mul, red_flag)
+        if noise_frames:
+            writer.write(np.clip(frame + noise_frames[frame_index % len(noise_frames)], 0, 255).astype(np.uint8))
+        else:
+            writer.write(frame)
+    writer.release()
+
+    with open(os.path.splitext(path)[0] + ".json", "w") as file:
+        json.dump(truth, file)
+    return truth
+
+
+def get_shown(truth: dict, frame_index: int):
+    # Driver order and sector times on screen at a frame
+    order = [order for start, order in truth["orders"] if start <= frame_index][-1]
+    shown = {driver: {1: 0., 2: 0., 3: 0.} for driver in order}
+    for start, driver, sector, sector_time in truth["times"]:
+        if start > frame_index:
+            break
+        shown[driver][sector] = sector_time
+    return order, shown
+
+
+def is_red_flag_frame(truth: dict, frame_index: int):
+    return any(start <= frame_index < end for start, end in truth["red_flags"])
+
+
+def measure_gathering(race: RaceSettings):
+    frame_indices = get_video_samples(race)
+    start = time.perf_counter()
+    samples = [(frame_index, sample) for frame_index, sample in iterate_samples(race, frame_indices)
+               if sample is not None]
+    elapsed = time.perf_counter() - start
+    return samples, {"samples": len(frame_indices), "samples_per_second": len(frame_indices) / elapsed}
+
+
+def measure_ocr(race: RaceSettings, samples: list, limit: int):
+    # Plain backend calls on the non-blank cells of the samples, without the OCR cache
+    backend = ocr.get_backend(race.ocr)
+    cells = []
+    for _, (drivers_image, sectors_image) in samples:
+        for image, kind, whitelist in [(drivers_image, "drivers", race.ocr.driver_whitelist),
+                                       (sectors_image, "sectors", race.ocr.sector_whitelist)]:
+            _, kind_cells, not_black = extract_cells(image, kind, race.res_mul, race.drivers_on_grid)
+            cells += [(cell, whitelist) for cell, cell_not_black in zip(kind_cells, not_black) if cell_not_black]
+        if len(cells) >= limit:
+            break
+    cells = cells[:limit]
+
+    start = time.perf_counter()
+    for cell, whitelist in cells:
+        backend.image_to_string(cell, whitelist)
+    return {"cells": len(cells), "cells_per_second": len(cells) / (time.perf_counter() - start)}
+
+
+def measure_accuracy(race: RaceSettings, truth: dict, samples: list, limit: int):
+    # Field-level accuracy of single frames: every driver name and every sector cell (blank or a time)
+    drivers_correct = sectors_correct = fields = 0
+    for frame_index, (drivers_image, sectors_image) in samples[:limit]:
+        order, shown = get_shown(truth, frame_index)
+        names = parse_drivers(drivers_image, race)
+        times = limit_sector_times(parse_sectors(sectors_image, race))
+        for row, driver in enumerate(order):
+            drivers_correct += len(names) > row and names[row] == driver
+            sectors_correct += sum(abs(times[row][sector] - shown[driver][sector]) < 0.0005 for sector in [1, 2, 3])
+        fields += len(order)
+    return {"frames": min(limit, len(samples)), "driver_accuracy": drivers_correct / max(1, fields),
+            "sector_accuracy": sectors_correct / max(1, fields * 3)}
+
+
+def use_cold_cache(settings: OCRSettings):
+    # Every run starts with an empty OCR cache, so earlier runs don't speed it up
+    ocr.caches[settings.cache_key] = ocr.OCRCache(settings.cache_size, ocr.get_fingerprint(settings))
+    ocr.get_backend(settings)
+
+
+def measure_end_to_end(race: RaceSettings, truth: dict):
+    use_cold_cache(race.ocr)
+    get_metrics().drain()
+    start = time.perf_counter()
+    with Pool(max(1, race.processing_workers), initializer=use_cold_cache, initargs=(race.ocr,)) as pool:
+        process_screenshots(race, stream_screenshots(race, False, pool=pool), get_video_fps(race.video_path),
+                            pool=pool)
+    elapsed = time.perf_counter() - start
+    counters = get_metrics().drain()[0]
+    hours = truth["frames"] / truth["frames_per_second"] / 3600
+
+    # Every time that was on screen outside a red flag should be in the sector store, and nothing else
+    outside_red_flags = np.ones(truth["frames"] + 1, int)
+    for start_frame, end_frame in truth["red_flags"]:
+        outside_red_flags[start_frame:end_frame] = 0
+    outside_red_flags = np.concatenate([[0], np.cumsum(outside_red_flags)])
+    visible = {}
+    ends = {}
+    for start_frame, driver, sector, sector_time in reversed(truth["times"]):
+        end_frame = ends.get((driver, sector), truth["frames"])
+        ends[(driver, sector)] = start_frame
+        if outside_red_flags[end_frame] > outside_red_flags[start_frame]:
+            # A time that appears during a red flag is only visible once it's over
+            visible[(driver, sector, sector_time)] = max([start_frame] + [end for start, end in truth["red_flags"]
+                                                                          if start <= start_frame < end])
+
+    store = SectorStore(race.store_path)
+    stored = {(store.drivers[driver], int(sector), round(float(sector_time), 3)): int(frame)
+              for driver, sector, sector_time, frame in zip(store["driver"], store["sector"], store["time"],
+                                                            store["frame"])}
+    found = [row for row in stored if row in visible]
+    # How long after it appeared a time was sampled
+    delays = np.array([stored[row] - visible[row] for row in found]) / truth["frames_per_second"]
+    return {"seconds": elapsed, "seconds_per_race_hour": elapsed / hours,
+            "decoded_frames": counters.get("gathering.frames_decoded", 0),
+            "processed_frames": counters.get("processing.frames", 0),
+            "visible_times": len(visible), "stored_times": len(stored),
+            "recall": len(found) / max(1, len(visible)), "precision": len(found) / max(1, len(stored)),
+            "mean_delay_sec": float(delays.mean()) if len(found) else None,
+            "max_delay_sec": float(delays.max()) if len(found) else None}
+
+
+def run_benchmark(resolution: int, args):
+    directory = os.path.join(benchmark_dir, f"{resolution}p")
+    os.makedirs(directory, exist_ok=True)
+    video_path = os.path.join(directory, "race.mp4")
+    truth_path = os.path.join(directory, "race.json")
+    if args.regenerate or not os.path.exists(truth_path):
+        print(f"Generating a {args.minutes} minute {resolution}p race...")
+        truth = generate_race(video_path, resolution, args.minutes, seed=args.seed, red_flags=args.red_flags,
+                              noise=args.noise)
+    else:
+        with open(truth_path, "r") as file:
+            truth = json.load(file)
+
+    # The benchmark's cache entries shouldn't end up in the persisted OCR cache
+    overrides = {"resolution": resolution, "ocr": {"cache_path": None},
+                 "race_gathering": {"start_offset_min": 0, "end_offset_min": 0, "step": args.step,
+                                    "sampling_schedule": "fixed"}}
+    race = RaceSettings(video_path, overrides, os.path.join(directory, "screenshots"),
+                        os.path.join(directory, "output"))
+    samples, gathering = measure_gathering(race)
+    result = {"gathering": gathering, "ocr": measure_ocr(race, samples, args.cells),
+              "accuracy": measure_accuracy(race, truth, samples, args.frames)}
+    print(f"{resolution}p: gathering {gathering['samples_per_second']:.1f} samples/s | "
+          f"OCR {result['ocr']['cells_per_second']:.1f} cells/s | "
+          f"drivers {result['accuracy']['driver_accuracy']:.1%}, "
+          f"sectors {result['accuracy']['sector_accuracy']:.1%} of the fields read correctly")
+
+    adaptive = {key: value for key, value in [("min_interval_sec", args.min_interval),
+                                              ("max_interval_sec", args.max_interval),
+                                              ("bisect_resolution_sec", args.bisect_resolution)]
+                if value is not None}
+    for schedule in args.schedules:
+        race = RaceSettings(video_path, merge_config(overrides, {"race_gathering": {"sampling_schedule": schedule,
+                                                                                    **adaptive}}),
+                            os.path.join(directory, "screenshots"), os.path.join(directory, schedule))
+        end_to_end = result[f"end_to_end_{schedule}"] = measure_end_to_end(race, truth)
+        if end_to_end["mean_delay_sec"] is None:
+            delay = "no times stored"
+        else:
+            delay = (f"times stored {end_to_end['mean_delay_sec']:.1f}s (at most {end_to_end['max_delay_sec']:.1f}s) "
+                     f"after they appeared")
+        print(f"{resolution}p {schedule}: end-to-end {end_to_end['seconds_per_race_hour']:.0f} s per race hour, "
+              f"{end_to_end['decoded_frames']} frames decoded, {end_to_end['processed_frames']} OCR'd | "
+              f"sector store recall {end_to_end['recall']:.1%}, precision {end_to_end['precision']:.1%}, {delay}")
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark gathering, OCR and processing on synthetic races '
+                                                 'with known sector times.')
+    parser.add_argument('--resolutions', type=int, nargs='+', default=[720, 1080], help='video heights to test')
+    parser.add_argument('--minutes', type=float, default=5, help='length of the generated races')
+    parser.add_argument('--step', type=float, default=5, help='seconds between sampled frames')
+    parser.add_argument('--schedules', nargs='+', default=['fixed', 'adaptive'], choices=['fixed', 'adaptive'],
+                        help='sampling schedules to compare end-to-end')
+    parser.add_argument('--min-interval', type=float, help='min_interval_sec of the adaptive schedule')
+    parser.add_argument('--max-interval', type=float, help='max_interval_sec of the adaptive schedule')
+    parser.add_argument('--bisect-resolution', type=float, help='bisect_resolution_sec of the adaptive schedule')
+    parser.add_argument('--red-flags', type=int, default=1, help='30 second red flag periods per race')
+    parser.add_argument('--noise', type=float, default=4, help='standard deviation of the added pixel noise')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the generated races')
+    parser.add_argument('--cells', type=int, default=300, help='cells to recognize for the OCR throughput')
+    parser.add_argument('--frames', type=int, default=20, help='frames to check field by field')
+    parser.add_argument('--regenerate', action='store_true', help='generate the races again')
+    args = parser.parse_args()
+
+    report = {str(resolution): run_benchmark(resolution, args) for resolution in args.resolutions}
+    with open(os.path.join(benchmark_dir, "report.json"), "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"Report written to {os.path.join(benchmark_dir, 'report.json')}")
@@ -0,0 +1,50 @@
+#!/usr/bin/python
+
+import argparse as argparse
+import re
+
+from src.race.data_processing import get_screenshot_samples, load_screenshots
+from src.race.cell_grid import extract_cells
+from src.race.glyphs import build_classifier
+from src.race.race_settings import RaceSettings
+from src.race.ocr import backends
+
+
+parser = argparse.ArgumentParser(
+    description='Build the glyph template bank for the "template" OCR backend from gathered screenshots.\n'
+                'Cells are labelled with the template fallback backend, only well-formed results are used.')
+
+parser.add_argument('-s', '--screenshots', type=str, default="screenshots", help='directory with gathered screenshots')
+parser.add_argument('-o', '--output', type=str, help='template bank to write (ocr.template_bank by default)')
+parser.add_argument('-l', '--limit', type=int, default=50, help='maximum number of screenshots to label')
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    race = RaceSettings()
+    ocr = backends[race.ocr.template_fallback](race.ocr)
+    drivers = race.drivers
+    labelled_cells = []
+
+    samples = get_screenshot_samples(args.screenshots)[:args.limit]
+    for _, drivers_image, sectors_image in load_screenshots(samples, args.screenshots):
+        _, cells, cells_not_black = extract_cells(drivers_image, "drivers", race.res_mul, race.drivers_on_grid)
+        for cell, not_black in zip(cells, cells_not_black):
+            if not_black:
+                text = ocr.image_to_string(cell, race.ocr.driver_whitelist).strip()
+                if text in drivers:
+                    labelled_cells.append((cell, text))
+
+        _, cells, cells_not_black = extract_cells(sectors_image, "sectors", race.res_mul, race.drivers_on_grid)
+        for cell, not_black in zip(cells, cells_not_black):
+            if not_black:
+                text = ocr.image_to_string(cell, race.ocr.sector_whitelist).strip()
+                if re.fullmatch(r'\d\d\.\d\d\d', text):
+                    labelled_cells.append((cell, text))
+
+    if len(labelled_cells) == 0:
+        raise Exception("None of the screenshots could be labelled, gather screenshots first")
+
+    classifier, counts = build_classifier(labelled_cells)
+    classifier.save(args.output or race.ocr.template_bank)
+    print(f"Built {len(counts)} templates from {len(labelled_cells)} cells in {len(samples)} screenshots: ", counts)
@@ -0,0 +1,19 @@
+#!/usr/bin/python
+
+import argparse as argparse
+
+from src.race.race_settings import RaceSettings
+from src.race.sector_store import convert_pickle, store_path
+
+
+parser = argparse.ArgumentParser(
+    description='Convert sector data pickled by older versions (output/sector_data) to a sector store.\n'
+                'Frames are numbered by position in the pickled lists and have no timestamps.')
+
+parser.add_argument('-i', '--input', type=str, default="output/sector_data", help='pickled sector data to convert')
+parser.add_argument('-o', '--output', type=str, default=store_path, help='sector store to write')
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    rows = convert_pickle(args.input, args.output, RaceSettings().drivers)
+    print(f"Converted {rows} sector times from {args.input} to {args.output}")
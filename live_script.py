@@ -0,0 +1,21 @@
+#!/usr/bin/python
+
+import argparse as argparse
+
+from src.race.race_settings import RaceSettings
+
+
+parser = argparse.ArgumentParser(
+    description='Follow an F1TV Data Channel recording that is still being written (or a stream URL) and keep '
+                'the sector data up to date while the session runs.\n'
+                'The latest sector times of every driver are published to output/live.json.')
+
+parser.add_argument('path', metavar='p', type=str, help='recording or stream to follow')
+parser.add_argument('--replay', metavar='SPEED', type=float,
+                    help='replay a finished recording at SPEED times real time (1 for real time)')
+parser.add_argument('-r', '--resume', help='resume from the last processing checkpoint', action='store_true')
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    from src.race.live import run_live
+    run_live(RaceSettings(args.path), args.replay, args.resume)
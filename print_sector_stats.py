@@ -0,0 +1,32 @@
+#!/usr/bin/python
+
+import argparse as argparse
+
+from src.race.race_settings import RaceSettings
+from src.race.sector_store import store_path
+
+
+parser = argparse.ArgumentParser(
+    description='Print sector statistics of processed sector data without rendering any plots.\n'
+                'The statistics are cached next to the sector store and rebuilt when the data changes.')
+
+parser.add_argument('drivers', metavar='d', type=str, nargs='*', help='drivers to show (all by default)')
+parser.add_argument('-i', '--input', type=str, default=store_path, help='sector store to read')
+parser.add_argument('-s', '--sector', type=int, choices=[1, 2, 3], help='only show this sector')
+parser.add_argument('-g', '--gaps', help='show the gaps in mean sector time between drivers instead',
+                    action='store_true')
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    from src.race.sector_stats import get_stats
+    stats = get_stats(args.input, RaceSettings().visualization)
+
+    df = stats["gaps"] if args.gaps else stats["sectors"]
+    if args.drivers:
+        df = df[df.index.get_level_values("driver").isin(args.drivers)]
+        if args.gaps:
+            df = df[[driver for driver in df.columns if driver in args.drivers]]
+    if args.sector:
+        df = df[df.index.get_level_values("sector") == args.sector]
+
+    print(df.to_string(float_format="%.3f"))
@@ -2,9 +2,9 @@
 
 import argparse as argparse
 
-from src.race.data_processing import process_screenshots
-from src.race.data_gathering import gather_screenshots
-from src.race.data_visualization import visualize_data
+from src.race.race_settings import RaceSettings
+from src.race.metrics import get_metrics, save_report
+from src.race.profiler import SamplingProfiler
 
 
 video_path = ""
@@ -17,20 +17,66 @@ parser.add_argument('path', metavar='p', type=str, nargs='+', help='gather data
 parser.add_argument('-g', '--gather', help='gather screenshots from race', action='store_true')
 parser.add_argument('-p', '--process', help='process screenshot data', action='store_true')
 parser.add_argument('-v', '--visualize', help='visualize sector data', action='store_true')
+parser.add_argument('--headless', help='render the figures in worker processes without showing them',
+                    action='store_true')
+parser.add_argument('-r', '--resume', help='resume processing from its last checkpoint and gather without removing '
+                                           'existing screenshots', action='store_true')
+parser.add_argument('--profile', metavar='PATH', type=str,
+                    help='sample the stack of the main process and write it to PATH (folded, for flame graphs)')
+parser.add_argument('--profile-interval', metavar='MS', type=float, default=10,
+                    help='milliseconds between profiler samples')
+parser.add_argument('--profile-all-threads', help='also sample the background threads (e.g. video decoding)',
+                    action='store_true')
 parser.add_argument('compare', metavar='c', type=str, nargs='+', help='drivers to compare')
 
-args = parser.parse_args()
-
-# If no arguments are given, execute everything.
-if not args.gather and not args.process and not args.visualize:
-    args.gather = args.process = args.visualize = True
-
-if args.gather:
-    print("Gathering screenshots...")
-    gather_screenshots(args.path[0])
-if args.process:
-    print("Processing screenshots...")
-    process_screenshots()
-if args.visualize:
-    print("Visualizing gathered data...")
-    visualize_data(args.compare if args.compare else None)
+# Pool workers re-import the scripts on Windows, so they only run under __main__. Stage modules are imported
+# by the stages that run, e.g. gathering never loads pandas or matplotlib.
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    # If no arguments are given, execute everything.
+    if not args.gather and not args.process and not args.visualize:
+        args.gather = args.process = args.visualize = True
+
+    profiler = None
+    if args.profile:
+        profiler = SamplingProfiler(args.profile_interval / 1000, args.profile_all_threads)
+        profiler.start()
+
+    race = RaceSettings(args.path[0])
+    metrics = get_metrics()
+    if args.gather and args.process:
+        from src.race.data_processing import process_screenshots, get_resume_frame
+        from src.race.data_gathering import stream_screenshots, get_video_fps
+
+        # Stream the gathered screenshots straight into processing instead of through screenshots/
+        print("Gathering and processing screenshots...")
+        first_frame = get_resume_frame(race) if args.resume else 0
+        with metrics.timer("stage.gather_and_process"):
+            process_screenshots(race, stream_screenshots(race, first_frame=first_frame),
+                                get_video_fps(race.video_path), resume=args.resume)
+    elif args.gather:
+        from src.race.data_gathering import gather_screenshots
+
+        print("Gathering screenshots...")
+        with metrics.timer("stage.gather"):
+            gather_screenshots(race, append=args.resume)
+    elif args.process:
+        from src.race.data_processing import process_screenshots
+
+        print("Processing screenshots...")
+        with metrics.timer("stage.process"):
+            process_screenshots(race, resume=args.resume)
+    if args.visualize:
+        from src.race.data_visualization import visualize_data
+
+        print("Visualizing gathered data...")
+        with metrics.timer("stage.visualize"):
+            visualize_data(race, args.compare if args.compare else None, args.headless)
+
+    save_report(race.metrics_dir, {"video": race.video_path, "gather": args.gather, "process": args.process,
+                                   "visualize": args.visualize, "resume": args.resume})
+    if profiler is not None:
+        profiler.stop()
+        profiler.save(args.profile)
+        profiler.print_top()
@@ -28,7 +28,8 @@ REQUIRED = [
 
 # Optional packages
 EXTRAS = {
-    # None
+    # In-process OCR backend ("backend": "tesserocr" in config.json)
+    'tesserocr': ['tesserocr~=2.5.1']
 }
 
 here = os.path.abspath(os.path.dirname(__file__))
@@ -0,0 +1,86 @@
+import os
+import json
+from multiprocessing import Pool
+from src.race.data_gathering import stream_screenshots, get_video_fps
+from src.race.data_processing import process_screenshots, get_resume_frame
+from src.race.ocr import get_backend
+from src.race.race_settings import RaceSettings, merge_config
+from src.race.metrics import get_metrics, save_report
+
+
+def load_manifest(path: str):
+    # A manifest is a list of races, or {"config": overrides for every race, "races": [...]}. Each race is a
+    # video path or {"video": path, "name": output directory name, "config": overrides for that race}.
+    with open(path, "r") as file:
+        manifest = json.load(file)
+    if isinstance(manifest, list):
+        manifest = {"races": manifest}
+
+    races = []
+    for race in manifest["races"]:
+        if isinstance(race, str):
+            race = {"video": race}
+        if "video" not in race:
+            raise Exception(f"Race without a video in manifest {path}: {race}")
+        # Relative video paths are relative to the manifest
+        video = os.path.join(os.path.dirname(path), race["video"])
+        races.append({"video": video, "name": race.get("name"),
+                      "config": merge_config(manifest.get("config", {}), race.get("config", {}))})
+    return races
+
+
+def get_batch_races(races: list, output_root: str):
+    # Every race gets its own screenshots and output directory under output_root, named after the video
+    # unless the manifest names it
+    batch = []
+    names = set()
+    for race in races:
+        name = race["name"] or os.path.splitext(os.path.basename(race["video"]))[0]
+        if name in names:
+            raise Exception(f"Two races in the batch are named {name}, name them in the manifest")
+        names.add(name)
+        batch.append(RaceSettings(race["video"], race["config"], os.path.join(output_root, name, "screenshots"),
+                                  os.path.join(output_root, name, "output")))
+    return batch
+
+
+def load_backends(settings: list):
+    # Pool initializer, every worker loads the OCR backends of all races in the batch once
+    for ocr_settings in settings:
+        get_backend(ocr_settings)
+
+
+def run_batch(races: list, pool_size: int = None, resume: bool = False, save: bool = None):
+    # Races run one after the other, each one streaming its screenshots into processing. Decoding and OCR of
+    # every race share one pool, so the batch never uses more than pool_size worker processes (the
+    # processing workers of the first race by default). Screenshots are saved with debug_screenshots unless
+    # save says otherwise.
+    failed = []
+    pool_size = races[0].processing_workers if pool_size is None else pool_size
+    with Pool(max(1, pool_size), initializer=load_backends, initargs=([race.ocr for race in races],)) as pool:
+        for i, race in enumerate(races):
+            print(f"Race {i + 1}/{len(races)}: {race.video_path} -> {race.output_dir}")
+            if not os.path.exists(race.video_path):
+                print(f"WARNING: Video {race.video_path} not found, skipping this race.")
+                failed.append(race)
+                continue
+
+            # A race that fails (e.g. a corrupt video or an OCR error) keeps its checkpoint for a resumed run,
+            # the other races still run
+            error = None
+            try:
+                first_frame = get_resume_frame(race) if resume else 0
+                with get_metrics().timer("stage.gather_and_process"):
+                    process_screenshots(race, stream_screenshots(race, save, first_frame, pool),
+                                        get_video_fps(race.video_path), resume=resume, pool=pool)
+            except Exception as e:
+                error = e
+                print(f"WARNING: Race {race.video_path} failed, continuing with the next race: {e!r}")
+                failed.append(race)
+            save_report(race.metrics_dir, {"video": race.video_path, "resume": resume, "batch_race": i + 1,
+                                           "error": repr(error) if error else None})
+
+    if len(failed) > 0:
+        print(f"WARNING: {len(failed)} of {len(races)} races were skipped or failed: "
+              f"{', '.join(race.video_path for race in failed)}")
+    return failed
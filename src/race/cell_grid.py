@@ -0,0 +1,92 @@
+from functools import lru_cache
+from math import floor
+import cv2 as cv
+import numpy as np
+from src.race.metrics import get_metrics
+
+# Text is white, so a cell without a preprocessed pixel above this is blank. Sharpening lifts the edges of
+# dim text (e.g. purple times) above it, which a threshold on the raw pixels would miss.
+ink_threshold = 200
+
+
+def get_tower_geometry(res_mul: float):
+    # Timing tower in the video frame as (top, bottom, left, right), and the width of the driver panel
+    # and start of the sector panel inside it
+    tower = int(107 * res_mul), int(525 * res_mul), int(106 * res_mul), int(1215 * res_mul)
+    return tower, int(42 * res_mul), int(910 * res_mul)
+
+
+def preprocess_image(image: np.ndarray, resize_scale: float, contrast: bool):
+    if image.ndim == 3:
+        image = cv.cvtColor(image, cv.COLOR_BGR2GRAY)
+    image = cv.resize(image, None, fx=resize_scale, fy=resize_scale)
+    if contrast:
+        image = cv.convertScaleAbs(image, alpha=2, beta=0)
+    kernel = np.array([[-1, -1, -1], [-1, 9, -1], [-1, -1, -1]])
+    image = cv.filter2D(image, -1, kernel)
+    return image
+
+
+class CellGrid:
+    # Cell geometry of a panel, computed once per panel size and scale. The panel is preprocessed in one go
+    # and only cells with ink are copied into the panel array the cells are views of.
+
+    def __init__(self, height: int, width: int, rows: int, columns: int, row_height: float, cell_width: float,
+                 resize_scale: int):
+        self.rows = rows
+        self.columns = columns
+        # The last row and column end at the panel edge, like the bottom driver row always did
+        self.row_edges = np.minimum(np.round(np.arange(self.rows + 1) * row_height).astype(int), height)
+        self.row_edges[-1] = height
+        self.column_edges = np.minimum(np.round(np.arange(columns + 1) * cell_width).astype(int), width)
+        self.column_edges[-1] = width
+        self.cell_height = floor(row_height * resize_scale)
+        self.cell_width = floor(cell_width * resize_scale)
+        self.resize_scale = resize_scale
+
+    def raw_cells(self, image: np.ndarray):
+        return [image[top:bottom, left:right]
+                for top, bottom in zip(self.row_edges[:-1], self.row_edges[1:])
+                for left, right in zip(self.column_edges[:-1], self.column_edges[1:])]
+
+    def find_ink(self, preprocessed: np.ndarray):
+        # Whether each cell has ink, in row major order, from one reduction over the whole preprocessed panel
+        ink = np.logical_or.reduceat(preprocessed > ink_threshold, self.row_edges[:-1] * self.resize_scale, axis=0)
+        return np.logical_or.reduceat(ink, self.column_edges[:-1] * self.resize_scale, axis=1).ravel()
+
+    def extract(self, image: np.ndarray, rows_wanted: list = None):
+        # Returns the preprocessed panel, its cells in row major order and which cells have ink.
+        # With rows_wanted, cells outside those rows count as blank and stay empty.
+        metrics = get_metrics()
+        with metrics.timer("cells.preprocess"):
+            preprocessed = preprocess_image(image, self.resize_scale, contrast=True)
+        cells_not_black = self.find_ink(preprocessed)
+        if rows_wanted is not None:
+            cells_not_black &= np.isin(np.arange(len(cells_not_black)) // self.columns, rows_wanted)
+
+        panel = np.zeros((self.rows * self.cell_height, self.columns * self.cell_width), np.uint8)
+        cells = panel.reshape(self.rows, self.cell_height, self.columns, self.cell_width).swapaxes(1, 2)
+        row_edges, column_edges = self.row_edges * self.resize_scale, self.column_edges * self.resize_scale
+        inked = np.flatnonzero(cells_not_black)
+        metrics.count("cells.inked", len(inked))
+        metrics.count("cells.blank", len(cells_not_black) - len(inked))
+        for index in inked:
+            row, column = divmod(index, self.columns)
+            cell = preprocessed[row_edges[row]:row_edges[row + 1], column_edges[column]:column_edges[column + 1]]
+            height, width = min(cell.shape[0], self.cell_height), min(cell.shape[1], self.cell_width)
+            cells[row, column, :height, :width] = cell[:height, :width]
+
+        return panel, [cell for row in cells for cell in row], cells_not_black.tolist()
+
+
+@lru_cache(maxsize=None)
+def get_grid(kind: str, height: int, width: int, res_mul: float, rows: int, resize_scale: int = 4):
+    # One row per driver on the grid, a driver panel has a single column and a sector panel three
+    if kind == "drivers":
+        return CellGrid(height, width, rows, 1, 21 * res_mul, width, resize_scale)
+    return CellGrid(height, width, rows, 3, 21 * res_mul, 70 * res_mul, resize_scale)
+
+
+def extract_cells(image: np.ndarray, kind: str, res_mul: float, rows: int, resize_scale: int = 4,
+                  rows_wanted: list = None):
+    return get_grid(kind, image.shape[0], image.shape[1], res_mul, rows, resize_scale).extract(image, rows_wanted)
@@ -1,71 +1,450 @@
 import cv2
 from tqdm import tqdm
 from glob import glob
+from math import ceil, floor
+from multiprocessing import Pool
+from queue import Queue
+from collections import deque
+from itertools import count, takewhile
+from threading import Thread
 import os
+import time
 import numpy as np
 import json
+from src.race.frame_changes import ChangeDetector, drop_unchanged, get_cell_thumbnails, get_changed_cells
+from src.race.cell_grid import get_tower_geometry
+from src.race.race_settings import RaceSettings
+from src.race.metrics import get_metrics
 
-with open("config.json", "rb") as f:
-    config = json.load(f)
+# Gaps shorter than this are decoded with grab() instead of seeking, since a seek
+# has to decode from the previous keyframe anyway.
+min_seek_seconds = 2
+# The adaptive schedule starts over at the beginning of every segment of this length. The bounds only
+# depend on the video, so serial, parallel and resumed runs probe the same frames.
+adaptive_segment_seconds = 300
 
-step = config["race_gathering"]["step"]
-start_offset = config["race_gathering"]["start_offset_min"] * 60
-end_offset = config["race_gathering"]["end_offset_min"] * 60
-res_mul = config["resolution"] / 720
 
+def iterate_sample_frames(race: RaceSettings, frames_per_second: float):
+    # Same frames the original read-every-frame loop picked: the first frame past both
+    # the start offset and one full step, then one frame every step + 1 frames.
+    step_frames = race.step * frames_per_second
+    return count(floor(max(race.start_offset * frames_per_second, step_frames)) + 1, floor(step_frames) + 1)
 
-def gather_screenshots(video_path: str):
-    global step, start_offset, end_offset
+
+def get_end_frame(race: RaceSettings, frames_per_second: float, total_frames: int):
+    # Sampling stops end_offset_min before the end of the video
+    return max(0, total_frames - floor(race.end_offset * frames_per_second))
+
+
+def get_sample_frames(race: RaceSettings, frames_per_second: float, total_frames: int):
+    end_frame = get_end_frame(race, frames_per_second, total_frames)
+    return list(takewhile(lambda frame_index: frame_index < end_frame,
+                          iterate_sample_frames(race, frames_per_second)))
+
+
+class FrameReader:
+    # Reads frames of a video by index. Short jumps forward are decoded with grab() (or read() in the "read"
+    # mode), longer ones seek. Going back, as the adaptive schedule does to bisect, seeks as well, or rewinds
+    # and grabs when the sampling mode doesn't seek.
+
+    def __init__(self, race: RaceSettings):
+        self.cap = cv2.VideoCapture(race.video_path)
+        self.frames_per_second = self.cap.get(cv2.CAP_PROP_FPS)
+        self.mode = race.sampling_mode
+        self.position = 0
+
+    def read(self, frame_index: int):
+        # Returns None past the end of the video
+        metrics = get_metrics()
+        start = time.perf_counter()
+        if frame_index < self.position or \
+                (self.mode == "seek" and frame_index - self.position > min_seek_seconds * self.frames_per_second):
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame_index if self.mode == "seek" else 0)
+            metrics.count("gathering.seeks")
+            metrics.count("gathering.frames_skipped", max(0, frame_index - self.position))
+            self.position = int(self.cap.get(cv2.CAP_PROP_POS_FRAMES))
+            if self.position > frame_index:
+                # The backend landed past the requested frame, so seeking can't be trusted
+                # for this file. Rewind and fall back to grabbing every frame.
+                print(f"WARNING: Seek to frame {frame_index} landed on {self.position}, falling back to grab().")
+                self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                self.position = 0
+                self.mode = "grab"
+
+        while self.position < frame_index:
+            ret = self.cap.grab() if self.mode != "read" else self.cap.read()[0]
+            if not ret:
+                return None
+            self.position += 1
+            metrics.count("gathering.frames_decoded")
+
+        ret, frame = self.cap.read()
+        if not ret:
+            return None
+        self.position += 1
+        metrics.count("gathering.frames_decoded")
+        metrics.count("gathering.samples")
+        metrics.add_time("gathering.decode", time.perf_counter() - start, histogram=True)
+
+        # The timestamp must match the frame the sequential loop would have picked
+        expected_msec = frame_index / self.frames_per_second * 1000
+        actual_msec = self.cap.get(cv2.CAP_PROP_POS_MSEC)
+        if actual_msec > 0 and abs(actual_msec - expected_msec) > 1000 / self.frames_per_second:
+            print(f"WARNING: Frame {frame_index} sampled at {actual_msec / 1000:.2f}s, "
+                  f"expected {expected_msec / 1000:.2f}s.")
+        return frame
+
+    def release(self):
+        self.cap.release()
+
+
+def sample_frames(reader: FrameReader, frame_indices: list):
+    # Yields (frame index, frame) for the frame indices in ascending order until the video ends
+    for frame_index in frame_indices:
+        frame = reader.read(frame_index)
+        if frame is None:
+            return
+        yield frame_index, frame
+
+
+def crop_frame(frame, res_mul: float):
+    (top, bottom, left, right), drivers_width, sectors_left = get_tower_geometry(res_mul)
+    drivers_and_sectors = frame[top:bottom, left:right]
+    drivers = drivers_and_sectors[:, :drivers_width]
+    sectors = drivers_and_sectors[:, sectors_left:]
+    return drivers, sectors
+
+
+def is_red_flag(frame, res_mul: float):
+    red_flag_frame = frame[int(35*res_mul):int(60*res_mul), int(285*res_mul):int(800*res_mul)]
+    red_flag_frame_hsv = cv2.cvtColor(red_flag_frame, cv2.COLOR_BGR2HSV)
+
+    # Lower mask (0-5) and upper mask (175-180) (RED)
+    mask1 = cv2.inRange(red_flag_frame_hsv, (0, 50, 20), (5, 255, 255))
+    mask2 = cv2.inRange(red_flag_frame_hsv, (175, 50, 20), (180, 255, 255))
+    mask = cv2.bitwise_or(mask1, mask2)
+    red_flag = cv2.bitwise_and(red_flag_frame, red_flag_frame, mask=mask)
+    return np.count_nonzero(red_flag) > 0
+
+
+def split_segments(frame_indices: list, segments: int):
+    segment_size = max(1, ceil(len(frame_indices) / segments))
+    return [frame_indices[i:i + segment_size] for i in range(0, len(frame_indices), segment_size)]
+
+
+def gather_segment(race: RaceSettings, frame_indices: list):
+    # Red flag frames are yielded as None, so a short segment shows that the video ended early
+    reader = FrameReader(race)
+    for frame_index, frame in sample_frames(reader, frame_indices):
+        if is_red_flag(frame, race.res_mul):
+            get_metrics().count("gathering.red_flag_drops")
+            yield frame_index, None
+        else:
+            yield frame_index, crop_frame(frame, race.res_mul)
+    reader.release()
+
+
+def collect_segment(segment: tuple):
+    # (gather function, its arguments...), the worker's metrics go back with the samples
+    gather, *arguments = segment
+    return list(gather(*arguments)), get_metrics().drain()
+
+
+def collect_segments(segments: list, workers: int, pool: Pool):
+    # Yields the samples of every segment in order. Only one segment per worker is queued at a time, so a
+    # shared pool can run OCR in between.
+    pending = deque(pool.apply_async(collect_segment, (segment,)) for segment in segments[:max(1, workers)])
+    remaining = deque(segments[max(1, workers):])
+    while pending:
+        result = pending.popleft()
+        if remaining:
+            pending.append(pool.apply_async(collect_segment, (remaining.popleft(),)))
+        samples, drained = result.get()
+        get_metrics().merge(drained)
+        yield samples
+
+
+def iterate_samples(race: RaceSettings, frame_indices: list, pool: Pool = None):
+    # Decodes in the given pool, or in a pool of its own with the configured number of workers
+    workers = race.gathering_workers
+    if pool is None:
+        if workers <= 1:
+            yield from gather_segment(race, frame_indices)
+        else:
+            with Pool(workers) as pool:
+                yield from iterate_samples(race, frame_indices, pool)
+        return
+
+    # A few segments per worker keeps the pool busy when some ranges decode slower than others
+    segments = split_segments(frame_indices, max(1, workers) * 4)
+    for segment, samples in zip(segments, collect_segments([(gather_segment, race, segment) for segment in segments],
+                                                           workers, pool)):
+        yield from samples
+        # The serial path stops at the first unreadable frame, so the remaining segments are dropped
+        if len(samples) < len(segment):
+            return
+
+
+def gather_adaptive_segment(race: RaceSettings, first_frame: int, end_frame: int):
+    # Probes the video every min_interval while the tower changes and doubles the interval up to
+    # max_interval while it doesn't. A change between two probes is bisected down to bisect_resolution,
+    # separately for cells that changed at different times, so every new sector time is sampled on (about)
+    # the frame it appeared on. Yields (frame index, crops) for the first probe and the probes that show
+    # something new, and (frame index, None) for red flag probes, before end_frame.
+    reader = FrameReader(race)
+    frames_per_second = reader.frames_per_second
+    min_step = max(1, round(race.min_interval * frames_per_second))
+    max_step = max(min_step, round(race.max_interval * frames_per_second))
+    resolution = max(1, round(race.bisect_resolution * frames_per_second))
+    metrics = get_metrics()
+
+    def probe(frame_index: int):
+        # (frame index, crops, cell thumbnails) with no crops or thumbnails on a red flag, None past the end
+        frame = reader.read(frame_index)
+        if frame is None:
+            return None
+        if is_red_flag(frame, race.res_mul):
+            metrics.count("gathering.red_flag_drops")
+            return frame_index, None, None
+        crops = crop_frame(frame, race.res_mul)
+        return frame_index, crops, get_cell_thumbnails(race, crops[0], "drivers") + \
+            get_cell_thumbnails(race, crops[1], "sectors")
+
+    def bisect(before: tuple, after: tuple, cells: set):
+        # Yields the probes between before and after that first show the changes of these cells
+        if after[0] - before[0] <= resolution:
+            yield after
+            return
+        middle = probe((before[0] + after[0]) // 2)
+        metrics.count("gathering.bisection_probes")
+        if middle is None:
+            yield after
+            return
+        if middle[1] is None:
+            # Nothing shows during a red flag, so the changes are looked for after it
+            yield from bisect((middle[0],) + before[1:], after, cells)
+            return
+        changed_before = get_changed_cells(race, before[2], middle[2], cells)
+        changed_after = get_changed_cells(race, middle[2], after[2], cells)
+        # A cell can change in both halves
+        if changed_before:
+            yield from bisect(before, middle, changed_before)
+        if changed_after:
+            yield from bisect(middle, after, changed_after)
+        elif not changed_before:
+            # The change crept in over both halves, neither is over the threshold on its own
+            yield after
+
+    try:
+        previous = probe(first_frame)
+        if previous is None:
+            return
+        yield previous[:2]
+        frame_index = first_frame
+        step = min_step
+        # The last probe is on the segment's last frame, the next segment starts right after it
+        while frame_index < end_frame - 1:
+            frame_index = min(frame_index + step, end_frame - 1)
+            current = probe(frame_index)
+            if current is None:
+                return
+            if current[1] is None:
+                yield current[:2]
+                step = min(step * 2, max_step)
+                continue
+            if previous[1] is None:
+                yield current[:2]
+                previous, step = current, min_step
+                continue
+
+            changed = get_changed_cells(race, previous[2], current[2], range(len(current[2])))
+            if not changed:
+                metrics.count("gathering.static_probes")
+                step = min(step * 2, max_step)
+                continue
+            for sample in bisect(previous, current, changed):
+                yield sample[:2]
+            previous, step = current, min_step
+    finally:
+        reader.release()
+
+
+def get_adaptive_segments(race: RaceSettings):
+    # (first frame, end frame) of every segment the adaptive schedule runs on its own
+    first_frame, end_frame = get_video_range(race)
+    length = max(1, round(adaptive_segment_seconds * get_video_fps(race.video_path)))
+    bounds = list(range(first_frame, end_frame, length)) + [end_frame]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def iterate_adaptive_samples(race: RaceSettings, first_frame: int = 0, pool: Pool = None):
+    # Like iterate_samples, in the given pool or one of its own. A resumed run starts over at the beginning
+    # of the segment first_frame is in and drops the samples before first_frame, so it samples the same
+    # frames as a run that wasn't interrupted.
+    workers = race.gathering_workers
+    if pool is None and workers > 1:
+        with Pool(workers) as pool:
+            yield from iterate_adaptive_samples(race, first_frame, pool)
+        return
+
+    segments = [(gather_adaptive_segment, race, start, end) for start, end in get_adaptive_segments(race)
+                if end > first_frame]
+    if pool is None:
+        samples = (sample for _, _, start, end in segments for sample in gather_adaptive_segment(race, start, end))
+    else:
+        samples = (sample for segment_samples in collect_segments(segments, workers, pool)
+                   for sample in segment_samples)
+    for frame_index, sample in samples:
+        if frame_index >= first_frame:
+            yield frame_index, sample
+
+
+def open_video(video_path: str):
+    # Without a frame rate no sample frame can be computed, e.g. for a corrupt or truncated file
     cap = cv2.VideoCapture(video_path)
-    currentframe = 0
+    if not cap.isOpened() or cap.get(cv2.CAP_PROP_FPS) <= 0:
+        cap.release()
+        raise Exception(f"Could not read the video {video_path}")
+    return cap
+
+
+def get_video_range(race: RaceSettings):
+    # First frame of the schedule and the frame it stops before
+    cap = open_video(race.video_path)
     frames_per_second = cap.get(cv2.CAP_PROP_FPS)
-    start_offset *= frames_per_second
-    end_offset *= frames_per_second
-    frames_count = int((cap.get(cv2.CAP_PROP_FRAME_COUNT) - start_offset - end_offset) / (step * frames_per_second))
-    started = False
-    frames_captured = 0
-    base_dir = "screenshots"
-
-    screenshots = glob(base_dir + "/drivers/*") + glob(base_dir + "/sectors/*")
+    first_frame = floor(race.start_offset * frames_per_second)
+    end_frame = get_end_frame(race, frames_per_second, int(cap.get(cv2.CAP_PROP_FRAME_COUNT)))
+    cap.release()
+    return first_frame, end_frame
+
+
+def iterate_video_samples(race: RaceSettings, first_frame: int = 0, pool: Pool = None):
+    # (frame index, (drivers, sectors) or None on a red flag) of the configured schedule from first_frame on
+    if race.sampling_schedule == "adaptive":
+        return iterate_adaptive_samples(race, first_frame, pool)
+    if race.sampling_schedule == "fixed":
+        return iterate_samples(race, [frame_index for frame_index in get_video_samples(race)
+                                      if frame_index >= first_frame], pool)
+    raise Exception(f"Unknown sampling schedule {race.sampling_schedule}, use fixed or adaptive")
+
+
+def remove_screenshots(race: RaceSettings):
+    screenshots = glob(race.screenshots_dir + "/drivers/*") + glob(race.screenshots_dir + "/sectors/*")
     for screenshot in screenshots:
         os.remove(screenshot)
     print(f"Removed {len(screenshots)} existing screenshots.")
 
-    with tqdm(total=frames_count, position=0, leave=True, ascii=True) as progress_bar:
-        while True:
-            ret, frame = cap.read()
-            if ret:
-                if currentframe > start_offset or started:
-                    started = True
-                    if currentframe > (step * frames_per_second):
-                        currentframe = 0
-
-                        drivers_and_sectors = frame[int(107*res_mul):int(525*res_mul), int(106*res_mul):int(1215*res_mul)]
-                        drivers = drivers_and_sectors[:, :int(42*res_mul)]
-                        sectors = drivers_and_sectors[:, int(910*res_mul):]
-
-                        red_flag_frame = frame[int(35*res_mul):int(60*res_mul), int(285*res_mul):int(800*res_mul)]
-                        red_flag_frame_hsv = cv2.cvtColor(red_flag_frame, cv2.COLOR_BGR2HSV)
-
-                        # Lower mask (0-5) and upper mask (175-180) (RED)
-                        mask1 = cv2.inRange(red_flag_frame_hsv, (0, 50, 20), (5, 255, 255))
-                        mask2 = cv2.inRange(red_flag_frame_hsv, (175, 50, 20), (180, 255, 255))
-                        mask = cv2.bitwise_or(mask1, mask2)
-                        red_flag = cv2.bitwise_and(red_flag_frame, red_flag_frame, mask=mask)
-
-                        if np.count_nonzero(red_flag) == 0:
-                            cv2.imwrite(base_dir + "/drivers/" + str(frames_captured) + ".png", drivers)
-                            cv2.imwrite(base_dir + "/sectors/" + str(frames_captured) + ".png", sectors)
-
-                        frames_captured += 1
-                        progress_bar.update(1)
-                currentframe += 1
-            else:
-                break
+
+def get_gathered_frames(race: RaceSettings):
+    return sorted(int(os.path.splitext(os.path.basename(screenshot))[0])
+                  for screenshot in glob(race.screenshots_dir + "/sectors/*.png"))
+
+
+def save_screenshots(race: RaceSettings, sample: int, drivers, sectors):
+    with get_metrics().timer("gathering.png_write", histogram=True):
+        cv2.imwrite(race.screenshots_dir + "/drivers/" + str(sample) + ".png", drivers)
+        cv2.imwrite(race.screenshots_dir + "/sectors/" + str(sample) + ".png", sectors)
+
+
+def save_screenshots_info(race: RaceSettings):
+    # Screenshots are named after their frame in the video, processing needs the frame rate to time them
+    for directory in ["drivers", "sectors"]:
+        os.makedirs(os.path.join(race.screenshots_dir, directory), exist_ok=True)
+    with open(race.screenshots_dir + "/video.json", "w") as file:
+        json.dump({"video": race.video_path, "frames_per_second": get_video_fps(race.video_path)}, file, indent=2)
+
+
+def get_video_fps(video_path: str):
+    cap = cv2.VideoCapture(video_path)
+    frames_per_second = cap.get(cv2.CAP_PROP_FPS)
+    cap.release()
+    return frames_per_second
+
+
+def get_video_samples(race: RaceSettings):
+    cap = open_video(race.video_path)
+    frame_indices = get_sample_frames(race, cap.get(cv2.CAP_PROP_FPS), int(cap.get(cv2.CAP_PROP_FRAME_COUNT)))
+    cap.release()
+    return frame_indices
+
+
+def gather_screenshots(race: RaceSettings, append: bool = False):
+    # With append, existing screenshots are kept and only frames after the last one are gathered
+    first_frame, end_frame = get_video_range(race)
+    detector = ChangeDetector(race)
+    if append:
+        gathered_frames = get_gathered_frames(race)
+        if len(gathered_frames) > 0:
+            first_frame = max(first_frame, gathered_frames[-1] + 1)
+            # New frames are compared with the last screenshot, like they would have been in one run
+            detector.is_changed([cv2.imread(f"{race.screenshots_dir}/{directory}/{gathered_frames[-1]}.png")
+                                 for directory in ["drivers", "sectors"]])
+        print(f"Appending to {len(gathered_frames)} existing screenshots.")
+    else:
+        remove_screenshots(race)
+    save_screenshots_info(race)
+
+    # The adaptive schedule doesn't know its samples in advance, so progress is counted in video frames
+    with tqdm(total=max(0, end_frame - first_frame), unit="frame", position=0, leave=True,
+              ascii=True) as progress_bar:
+        def captured_samples():
+            position = first_frame
+            for frame_index, sample in iterate_video_samples(race, first_frame):
+                progress_bar.update(frame_index + 1 - position)
+                position = frame_index + 1
+                if sample is not None:
+                    yield frame_index, *sample
+
+        # Samples that look the same as the previous screenshot would only be dropped again after OCR
+        for sample in drop_unchanged(captured_samples(), detector):
+            save_screenshots(race, *sample)
 
     list(getattr(tqdm, '_instances'))
     for instance in list(tqdm._instances):
         tqdm._decr_instances(instance)
 
-    cap.release()
     cv2.destroyAllWindows()
+
+
+def stream_screenshots(race: RaceSettings, save: bool = None, first_frame: int = 0, pool: Pool = None):
+    # Decodes in a background thread and yields (frame index, drivers, sectors) for every non red flag
+    # sample from first_frame on, so the consumer can run OCR while the next frames are being decoded.
+    # The screenshots are saved as well with save, or with debug_screenshots by default.
+    save = race.debug_screenshots if save is None else save
+    if save:
+        if first_frame == 0:
+            remove_screenshots(race)
+        save_screenshots_info(race)
+
+    def decode():
+        for frame_index, sample in iterate_video_samples(race, first_frame, pool):
+            if sample is not None:
+                if save:
+                    save_screenshots(race, frame_index, *sample)
+                yield frame_index, *sample
+
+    yield from in_background(decode(), race.queue_size)
+
+
+def in_background(samples, size: int):
+    # Runs the samples generator in a background thread, the bounded queue stops it from running
+    # more than size samples ahead of the consumer
+    queue = Queue(maxsize=size)
+    end_of_stream = object()
+
+    def produce():
+        try:
+            for sample in samples:
+                queue.put(sample)
+            queue.put(end_of_stream)
+        except Exception as e:
+            queue.put(e)
+
+    Thread(target=produce, daemon=True).start()
+    while True:
+        sample = queue.get()
+        if sample is end_of_stream:
+            break
+        if isinstance(sample, Exception):
+            raise sample
+        yield sample
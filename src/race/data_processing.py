@@ -1,97 +1,165 @@
-from math import ceil, floor
-import random
+from math import ceil
 from typing import List
 import numpy as np
-import pickle
 import glob
+import pickle
 import cv2 as cv
-from PIL import Image
-import pytesseract
 import re
 import difflib
 import os
+import time
+from multiprocessing import Pool
 from tqdm import tqdm
 import json
-
-with open("config.json", "rb") as f:
-    config = json.load(f)
-
-recursion_limit = 20
-recursions = 0
-
-drivers_on_grid = config["race_processing"]["drivers_on_grid"]
-res_mul = config["resolution"] / 720
-
-
-def preprocess_image(image_path: str, resize_scale: float, contrast: bool):
-    image = cv.imread(image_path)
-    image = cv.cvtColor(image, cv.COLOR_BGR2GRAY)
-    image = cv.resize(image, None, fx=resize_scale, fy=resize_scale)
-    if contrast:
-        image = cv.convertScaleAbs(image, alpha=2, beta=0)
-    kernel = np.array([[-1, -1, -1], [-1, 9, -1], [-1, -1, -1]])
-    image = cv.filter2D(image, -1, kernel)
-    return image
-
-
-def parse_drivers(image_path: str, resize_scale: int = 4):
-    all_data = []
-    drivers = preprocess_image(image_path, resize_scale, contrast=True)
-    drivers = split_drivers_image(drivers, resize_scale)
-
-    for driver in drivers:
-        pixel_is_not_black = np.array([value > 200 for value in [row for row in driver]])
-        if pixel_is_not_black.any():
-            driver_data = pytesseract.image_to_string(
-                Image.fromarray(driver),
-                lang='eng',
-                config='--psm 8 --oem 3 -c tessedit_char_whitelist=ABCDEFGHIJKLMNOPQRSTUVW'
-            )
-            all_data.append(driver_data)
-        else:
-            all_data.append("")
-
-    all_data = [driver.strip('\f').strip('\n')[:3] for driver in all_data]
-    assert len(all_data) == drivers_on_grid
-
-    # Spellchecking
-    drivers = [x["name"] for x in config["drivers"]]
-    for i in range(len(all_data)):
-        if all_data[i] not in drivers:
-            closest_matches = difflib.get_close_matches(all_data[i], drivers)
-            if len(closest_matches) < 1:
-                global recursion_limit, recursions
-                if recursions < recursion_limit:
-                    recursions += 1
-                    return parse_drivers(image_path, resize_scale=random.randint(2, 10))
-                else:
-                    return []
+from src.race.ocr import get_backend, get_cache
+from src.race.frame_changes import ChangeDetector, drop_unchanged, get_change_score, get_cell_thumbnails, \
+    get_changed_cells
+from src.race.cell_grid import extract_cells, get_grid
+from src.race.sector_store import SectorStoreWriter, count_rows
+from src.race.race_settings import RaceSettings, OCRSettings
+from src.race.timeline import RaceTimeline
+from src.race.data_gathering import in_background
+from src.race.metrics import get_metrics
+
+
+def ocr_panel(panel: np.ndarray, cells_not_black: List[bool], columns: int, cell_height: int, cell_width: int,
+              whitelist: str, settings: OCRSettings, page_segmentation: int = 11):
+    # One tesseract call for the whole panel. Every word box is assigned to the grid cell under its
+    # centre, words spanning several columns are split evenly over them.
+    rows = len(cells_not_black) // columns
+    data = get_backend(settings).image_to_data(panel, whitelist, page_segmentation)
+
+    words = [[] for _ in cells_not_black]
+    for text, left, top, width, height in zip(data["text"], data["left"], data["top"], data["width"], data["height"]):
+        text = text.strip()
+        if not text:
+            continue
+        row = min((top + height // 2) // cell_height, rows - 1)
+        first_column = min(left // cell_width, columns - 1)
+        last_column = min(max(first_column, (left + width - 1) // cell_width), columns - 1)
+        part_length = ceil(len(text) / (last_column - first_column + 1))
+        for part, column in enumerate(range(first_column, last_column + 1)):
+            words[row * columns + column].append((left, text[part * part_length:(part + 1) * part_length]))
+
+    return ["".join(text for _, text in sorted(cell_words)) if not_black else ""
+            for cell_words, not_black in zip(words, cells_not_black)]
+
+
+def read_cells(cells, cells_not_black: List[bool], whitelist: str, settings: OCRSettings, read_panel=None):
+    # Looks every non blank cell up in the OCR cache, and only runs OCR for the cells that miss:
+    # one call per cell, or a single panel call when read_panel is given.
+    cache = get_cache(settings)
+    mode = "panel" if read_panel else "cell"
+    keys = [cache.key(cell, whitelist, mode) if not_black else None for cell, not_black in zip(cells, cells_not_black)]
+    texts = [cache.get(key) if key is not None else "" for key in keys]
+
+    missing = [i for i, text in enumerate(texts) if text is None]
+    metrics = get_metrics()
+    metrics.count("ocr.cached_cells", sum(key is not None for key in keys) - len(missing))
+    if missing:
+        panel_texts = None
+        if read_panel:
+            with metrics.timer("ocr.panel_call", histogram=True):
+                panel_texts = read_panel()
+        for i in missing:
+            if panel_texts:
+                texts[i] = panel_texts[i]
             else:
-                # print(all_data[i] + " -> " + closest_matches[0])
-                all_data[i] = closest_matches[0]
-
-    print("Parsed drivers: ", all_data)
-    return all_data
-
-
-def parse_sectors(image_path: str):
+                with metrics.timer("ocr.cell_call", histogram=True):
+                    texts[i] = get_backend(settings).image_to_string(cells[i], whitelist)
+            cache.put(keys[i], texts[i])
+    return texts
+
+
+def parse_drivers(image: np.ndarray, race: RaceSettings, names: List[str] = None):
+    # Reads the rows whose name is None in names (all rows by default). Rows that don't spellcheck to a
+    # driver are read again at the next retry scale, a frame that still has unknown rows gives [].
+    names = list(names) if names else [None] * race.drivers_on_grid
+    drivers = race.drivers
+    metrics = get_metrics()
+
+    for attempt, resize_scale in enumerate(race.driver_retry_scales):
+        missing = [i for i, name in enumerate(names) if name is None]
+        if len(missing) == 0:
+            break
+        metrics.count("drivers.rows_read", len(missing))
+        if attempt > 0:
+            metrics.count("drivers.retries")
+            metrics.count("drivers.rows_retried", len(missing))
+
+        drivers_image, driver_images, drivers_not_black = extract_cells(image, "drivers", race.res_mul,
+                                                                        race.drivers_on_grid, resize_scale, missing)
+        # An empty row stays empty at every scale
+        if not all(drivers_not_black[i] for i in missing):
+            metrics.count("drivers.empty_rows")
+            return []
+
+        read_panel = None
+        if race.ocr_mode == "panel" and get_backend(race.ocr).supports_panels and \
+                len(missing) > race.drivers_on_grid // 2:
+            grid = get_grid("drivers", image.shape[0], image.shape[1], race.res_mul, race.drivers_on_grid,
+                            resize_scale)
+            read_panel = lambda: ocr_panel(drivers_image, drivers_not_black, 1, grid.cell_height, grid.cell_width,
+                                           race.ocr.driver_whitelist, race.ocr, page_segmentation=6)
+        all_data = read_cells(driver_images, drivers_not_black, race.ocr.driver_whitelist, race.ocr, read_panel)
+
+        # Spellchecking
+        for i in missing:
+            driver = all_data[i].strip('\f').strip('\n')[:3]
+            closest_matches = [driver] if driver in drivers else difflib.get_close_matches(driver, drivers)
+            if len(closest_matches) > 0:
+                names[i] = closest_matches[0]
+
+    if None in names:
+        metrics.count("drivers.unreadable_frames")
+        return []
+
+    print("Parsed drivers: ", names)
+    return names
+
+
+class DriverTracker:
+    # Remembers the driver rows of the last parsed sample. Rows that look the same as a row of that sample,
+    # at the same position or after a position change, keep its name, so only new rows get OCR'd.
+
+    def __init__(self, race: RaceSettings):
+        self.race = race
+        self.rows = []
+        self.names = []
+
+    def find_row(self, row: np.ndarray, position: int):
+        if position < len(self.rows) and get_change_score(self.rows[position], row) <= self.race.change_threshold:
+            return self.names[position]
+
+        scores = [get_change_score(previous_row, row) for previous_row in self.rows]
+        if len(scores) > 0 and min(scores) <= self.race.change_threshold:
+            return self.names[int(np.argmin(scores))]
+        return None
+
+    def parse(self, image: np.ndarray):
+        rows = get_cell_thumbnails(self.race, image, "drivers")
+        names = parse_drivers(image, self.race, [self.find_row(row, i) for i, row in enumerate(rows)])
+        if len(names) > 0:
+            self.rows, self.names = rows, names
+        return names
+
+
+def parse_sectors(image: np.ndarray, race: RaceSettings, name: str = ""):
     all_data = []
-    resize_scale = 4
-    sectors = preprocess_image(image_path, resize_scale, contrast=True)
-    sectors = split_sectors_image(sectors, resize_scale)
+    sectors_image, sectors, sectors_not_black = extract_cells(image, "sectors", race.res_mul, race.drivers_on_grid)
+
+    read_panel = None
+    if race.ocr_mode == "panel" and get_backend(race.ocr).supports_panels:
+        grid = get_grid("sectors", image.shape[0], image.shape[1], race.res_mul, race.drivers_on_grid)
+        read_panel = lambda: ocr_panel(sectors_image, sectors_not_black, 3, grid.cell_height, grid.cell_width,
+                                       race.ocr.sector_whitelist, race.ocr)
+    sector_texts = read_cells(sectors, sectors_not_black, race.ocr.sector_whitelist, race.ocr, read_panel)
 
-    for i in range(drivers_on_grid):
+    for i in range(race.drivers_on_grid):
         all_data.append({})
         for j in range(3):
-            pixel_is_not_black = np.array([value > 200 for value in [row for row in sectors[(i*3)+j]]])
-            if pixel_is_not_black.any():
-                sector_data = pytesseract.image_to_string(
-                    Image.fromarray(sectors[(i*3)+j]),
-                    lang='eng',
-                    config='--psm 8 --oem 3 -c tessedit_char_whitelist=0123456789. '
-                )
-
-                sector_data = re.findall('......', sector_data)
+            if sectors_not_black[(i*3)+j]:
+                sector_data = re.findall('......', sector_texts[(i*3)+j])
                 all_data[i][j+1] = sector_data[0] if len(sector_data) > 0 else '0'
             else:
                 all_data[i][j+1] = '0'
@@ -105,8 +173,9 @@ def parse_sectors(image_path: str):
                     all_data[line_idx][sector_idx] = float(all_data[line_idx][sector_idx][0])
 
             except ValueError:
+                get_metrics().count("sectors.parse_failures")
                 os.system("")
-                print(f"WARNING: Sector parsing failure in {image_path}: {all_data[line_idx][sector_idx]}")
+                print(f"WARNING: Sector parsing failure in {name}: {all_data[line_idx][sector_idx]}")
                 all_data[line_idx][sector_idx] = 0
 
     return all_data
@@ -130,12 +199,16 @@ def limit_sector_times(sectors):
         for sector in [1, 2, 3]:
             if sector in sectors[driver_index]:
                 if not 10 < sectors[driver_index][sector] < 100:
+                    if sectors[driver_index][sector] != 0:
+                        get_metrics().count("sectors.out_of_range")
                     sectors[driver_index][sector] = 0
 
     return sectors
 
 
-def check_almost_equal(old_sectors, new_sectors, total_allowed_diff_sec=1):
+def check_almost_equal(old_sectors, new_sectors, total_allowed_diff_sec=1, changed_cells=None):
+    # Small differences are taken for misreads of the same times. A time that differs in one of the
+    # changed_cells, the (row, sector) cells that visibly changed, is a new time however small the difference.
     if old_sectors == new_sectors:
         return True
 
@@ -147,107 +220,210 @@ def check_almost_equal(old_sectors, new_sectors, total_allowed_diff_sec=1):
             for sec in [1, 2, 3]:
                 if sec in new_sectors[i] and sec in old_sectors[i]:
                     if new_sectors[i][sec] != old_sectors[i][sec]:
+                        if changed_cells is not None and (i, sec) in changed_cells:
+                            return False
                         diff += abs(new_sectors[i][sec] - old_sectors[i][sec])
 
     return diff < total_allowed_diff_sec
 
 
-def get_changed_data(all_data, new_data):
-    if all_data == new_data:
-        return new_data
+def get_screenshot_samples(source_path: str = "screenshots"):
+    # Screenshots are named after their sample number, which is a stable order unlike the mtime
+    def sample_numbers(directory: str):
+        return {int(os.path.splitext(os.path.basename(img))[0]) for img in glob.glob(f'{source_path}/{directory}/*.png')}
 
-    for driver in new_data.keys():
-        for sec in [1, 2, 3]:
-            if driver in all_data:
-                if sec in new_data[driver] and sec in all_data[driver]:
-                    if new_data[driver][sec] == find_last_real_time(all_data[driver][sec]):
-                        new_data[driver][sec] = 0
+    return sorted(sample_numbers("drivers") & sample_numbers("sectors"))
 
-    return new_data
 
+def load_screenshots(samples: List[int], source_path: str = "screenshots"):
+    for sample in samples:
+        yield sample, cv.imread(f"{source_path}/drivers/{sample}.png"), cv.imread(f"{source_path}/sectors/{sample}.png")
 
-def find_last_real_time(sectors: List[float]):
-    for i in reversed(range(len(sectors))):
-        if sectors[i] > 0:
-            return sectors[i]
-    return 0
 
+def get_screenshots_fps(source_path: str = "screenshots"):
+    # Frame rate of the video the screenshots were gathered from, if it was recorded
+    try:
+        with open(f"{source_path}/video.json", "r") as file:
+            return json.load(file)["frames_per_second"]
+    except FileNotFoundError:
+        return None
 
-def split_drivers_image(preprocessed_image, resize_scale: int = 1):
-    pixels_per_driver = floor(21 * resize_scale * res_mul)
-    driver_images = []
-    for driver_idx in range(ceil(len(preprocessed_image) / pixels_per_driver)):
-        if driver_idx == drivers_on_grid - 1:
-            driver = preprocessed_image[driver_idx * pixels_per_driver:, :]
-        else:
-            driver = preprocessed_image[driver_idx * pixels_per_driver:driver_idx * pixels_per_driver + pixels_per_driver, :]
-        driver_images.append(driver)
 
-    assert(len(driver_images) == drivers_on_grid)
-    return driver_images
-
-
-def split_sectors_image(preprocessed_image, resize_scale: int = 1):
-    pixels_per_driver = floor(21 * resize_scale * res_mul)
-    pixels_per_sector = floor(70 * resize_scale * res_mul)
-    sector_images = []
-    for sector_idx in range(3):
-        for driver_idx in range(ceil(len(preprocessed_image) / pixels_per_driver)):
-            if driver_idx == drivers_on_grid - 1:
-                sector = preprocessed_image[driver_idx * pixels_per_driver:, sector_idx * pixels_per_sector:sector_idx * pixels_per_sector + pixels_per_sector]
-            else:
-                sector = preprocessed_image[driver_idx * pixels_per_driver:driver_idx * pixels_per_driver + pixels_per_driver,
-                         sector_idx * pixels_per_sector:sector_idx * pixels_per_sector + pixels_per_sector]
-            sector_images.append(sector)
-
-    assert (len(sector_images) == drivers_on_grid * 3)
-    sector_images = np.array(list(zip(sector_images[0:drivers_on_grid],
-                                      sector_images[drivers_on_grid:drivers_on_grid*2],
-                                      sector_images[drivers_on_grid*2:drivers_on_grid*3])), dtype=object).flatten()
-    return sector_images
-
-
-def process_screenshots():
-    tesseract_path = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
-    if os.path.exists(tesseract_path):
-        pytesseract.pytesseract.tesseract_cmd = tesseract_path
-    else:
-        print("WARNING: Could not find Tesseract-OCR 5.0.0 installation path.")
-
-    source_path = "screenshots"
-    driver_screenshots = [img for img in sorted(glob.glob(f'{source_path}/drivers/*.png'), key=os.path.getmtime)]
-    sector_screenshots = [img for img in sorted(glob.glob(f'{source_path}/sectors/*.png'), key=os.path.getmtime)]
-    total_screenshots = min(len(driver_screenshots), len(sector_screenshots))
-
-    all_data = {}
-    previous_sec = []
-    for driver_ss, sector_ss in tqdm(zip(driver_screenshots, sector_screenshots), total=total_screenshots):
-        dri = parse_drivers(driver_ss)
-        sec = parse_sectors(sector_ss)
+def parse_frame(sample: tuple, race: RaceSettings):
+    # Sector OCR for one sample, independent of the other samples so it can run in any worker.
+    # The drivers are already known, they're tracked from sample to sample in the main process.
+    sample, dri, sector_ss = sample
+    with get_metrics().timer("processing.sectors", histogram=True):
+        sec = parse_sectors(sector_ss, race, f"sample {sample}")
         sec = limit_sector_times(sec)
-
-        if check_almost_equal(previous_sec, sec):
-            continue
-
-        previous_sec = sec
-        if len(dri) == 0 or len(sec) == 0:
-            continue
-
-        combined_data = dict(zip(dri, sec))
-        combined_data = get_changed_data(all_data, combined_data)
-
-        for key in combined_data:
-            if key in all_data:
-                for sector in combined_data[key].keys():
-                    if sector in all_data[key]:
-                        all_data[key][sector].append(combined_data[key][sector])
-                    else:
-                        all_data[key][sector] = [combined_data[key][sector]]
+    return sample, dri, sec, get_cache(race.ocr).drain(), get_metrics().drain()
+
+
+def parse_frames(samples, race: RaceSettings, pool=None):
+    # A pool passed in (e.g. shared by a batch of races) is used as is, otherwise one is started here
+    workers = race.processing_workers
+    if pool is None and workers > 1:
+        with Pool(workers, initializer=get_backend, initargs=(race.ocr,)) as pool:
+            yield from parse_frames(samples, race, pool)
+        return
+
+    if pool is None:
+        yield from (parse_frame(sample, race) for sample in samples)
+        return
+
+    # Samples are submitted from a background thread and only a couple per worker are in flight, which
+    # keeps the results in sample order and stops a fast producer (e.g. a stream of decoded frames) from
+    # piling up in memory. Results are collected as soon as they're done, also when the producer is slow
+    # (e.g. a live recording).
+    def submit():
+        for sample in samples:
+            yield pool.apply_async(parse_frame, (sample, race))
+
+    for result in in_background(submit(), max(1, workers) * 2):
+        yield result.get()
+
+
+def save_checkpoint(state: dict, path: str):
+    # Written next to the checkpoint first, so an interruption can't leave a half written checkpoint
+    with open(path + ".tmp", 'wb') as file:
+        pickle.dump(state, file)
+    os.replace(path + ".tmp", path)
+
+
+def load_checkpoint(path: str):
+    try:
+        with open(path, 'rb') as file:
+            return pickle.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def get_resume_frame(race: RaceSettings):
+    # First frame that a resumed run still has to process
+    checkpoint = load_checkpoint(race.checkpoint_path)
+    return checkpoint["frame"] + 1 if checkpoint else 0
+
+
+def process_screenshots(race: RaceSettings = None, samples=None, frames_per_second: float = None,
+                        resume: bool = False, pool=None, publish=None):
+    # Samples are (frame index, drivers image, sectors image), read back from the screenshots by default.
+    # Every new sector time is appended to the sector store as soon as its frame is processed. The state
+    # after a processed frame is checkpointed every checkpoint_interval seconds and after the last frame, a
+    # resumed run drops the store rows written after the checkpoint and continues exactly where it stopped.
+    # publish is called with every processed frame and the timeline once the frame's times are stored.
+    race = race or RaceSettings()
+    os.makedirs(race.output_dir, exist_ok=True)
+    checkpoint = load_checkpoint(race.checkpoint_path) if resume else None
+    if resume and checkpoint is None:
+        print("WARNING: No processing checkpoint found, processing all screenshots.")
+    elif not resume and os.path.exists(race.checkpoint_path):
+        os.remove(race.checkpoint_path)
+    first_frame = checkpoint["frame"] + 1 if checkpoint else 0
+
+    total_samples = None
+    if samples is None:
+        screenshot_samples = [sample for sample in get_screenshot_samples(race.screenshots_dir)
+                              if sample >= first_frame]
+        total_samples = len(screenshot_samples)
+        samples = load_screenshots(screenshot_samples, race.screenshots_dir)
+        frames_per_second = get_screenshots_fps(race.screenshots_dir)
+    else:
+        samples = (sample for sample in samples if sample[0] >= first_frame)
+
+    detector = ChangeDetector(race)
+    tracker = DriverTracker(race)
+    if checkpoint:
+        print(f"Resuming processing after frame {checkpoint['frame']}.")
+        writer = SectorStoreWriter(race.store_path, frames_per_second, append=True, rows=checkpoint["rows"],
+                                   drivers=race.drivers)
+        timeline = checkpoint["timeline"]
+        previous_sec = checkpoint["previous_sec"]
+        previous_cells = checkpoint.get("previous_cells")
+        detector.previous = checkpoint["detector"]
+        tracker.rows, tracker.names = checkpoint["tracker"]
+    else:
+        writer = SectorStoreWriter(race.store_path, frames_per_second, drivers=race.drivers)
+        timeline = RaceTimeline()
+        previous_sec = []
+        previous_cells = None
+
+    # Change detection and driver tracking run ahead of the OCR workers, so their state and the sample's
+    # sector cell thumbnails are kept per sample until that sample's results come back
+    states = {}
+    metrics = get_metrics()
+
+    def track_drivers(samples):
+        for sample, driver_ss, sector_ss in samples:
+            with metrics.timer("processing.drivers", histogram=True):
+                dri = tracker.parse(driver_ss)
+            cells = get_cell_thumbnails(race, sector_ss, "sectors")
+            states[sample] = detector.previous, (tracker.rows, tracker.names), cells
+            yield sample, dri, sector_ss
+
+    cache = get_cache(race.ocr)
+    cache_hits = cache_misses = 0
+    last_checkpoint = time.perf_counter()
+    state = None
+    # Unchanged samples are dropped before OCR, the progress bar counts every sample that comes in
+    samples = track_drivers(drop_unchanged(tqdm(samples, total=total_samples), detector))
+    for sample, dri, sec, (hits, misses, new_entries), drained in parse_frames(samples, race, pool):
+        # Pool workers keep their own caches and metrics, so their new entries are collected here
+        cache_hits += hits
+        cache_misses += misses
+        cache.merge(new_entries)
+        metrics.merge(drained)
+        metrics.count("processing.frames")
+
+        # Sector cells that changed since the last sample whose times were kept hold new times, not misreads
+        detector_state, tracker_state, cells = states.pop(sample)
+        changed_cells = None
+        if previous_cells is not None:
+            changed = get_changed_cells(race, previous_cells, cells, range(min(len(cells), len(previous_cells))))
+            changed_cells = {(cell // 3, cell % 3 + 1) for cell in changed}
+        if not check_almost_equal(previous_sec, sec, changed_cells=changed_cells):
+            previous_sec, previous_cells = sec, cells
+            if len(dri) > 0 and len(sec) > 0:
+                with metrics.timer("processing.merge"):
+                    combined_data = timeline.merge(sample, dict(zip(dri, sec)))
+                    writer.write(sample, combined_data)
             else:
-                all_data[key] = {sec: [time] for sec, time in combined_data[key].items()}
-
-    print("Processed Sector Data: ", all_data)
-
-    outfile = open('output/sector_data', 'wb')
-    pickle.dump(all_data, outfile)
-    outfile.close()
+                metrics.count("processing.frames_without_drivers")
+        else:
+            metrics.count("processing.frames_unchanged")
+
+        state = {
+            "frame": sample,
+            "rows": writer.rows,
+            "timeline": timeline,
+            "previous_sec": previous_sec,
+            "previous_cells": previous_cells,
+            "detector": detector_state,
+            "tracker": tracker_state
+        }
+        # Pickling the whole timeline after every frame would grow with frames x timeline over a race
+        if time.perf_counter() - last_checkpoint >= race.checkpoint_interval:
+            with metrics.timer("processing.checkpoint"):
+                save_checkpoint(state, race.checkpoint_path)
+            last_checkpoint = time.perf_counter()
+            state = None
+        if publish is not None:
+            publish(sample, timeline)
+
+    if state is not None:
+        with metrics.timer("processing.checkpoint"):
+            save_checkpoint(state, race.checkpoint_path)
+    writer.close()
+    # Driver OCR runs in this process, so its cache statistics weren't collected with the frames
+    hits, misses, _ = cache.drain()
+    cache_hits += hits
+    cache_misses += misses
+    metrics.count("processing.store_rows", writer.rows)
+    metrics.count("ocr.cache_hits", cache_hits)
+    metrics.count("ocr.cache_misses", cache_misses)
+
+    print(f"Processed Sector Data: {count_rows(race.store_path)} sector times of {len(timeline)} drivers "
+          f"written to {race.store_path}")
+    print(f"OCR cache: {cache_hits} hits, {cache_misses} misses "
+          f"({cache_hits / max(1, cache_hits + cache_misses):.1%} of the cells skipped OCR)")
+    if race.ocr.cache_path:
+        cache.save(race.ocr.cache_path)
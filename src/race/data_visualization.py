@@ -1,68 +1,49 @@
-import pickle
+import os
 import random
 import matplotlib.pyplot as plt
-from itertools import groupby
 import seaborn as sns
 import pandas as pd
 import numpy as np
 from typing import List
-import json
+from multiprocessing import Pool
+from src.race.timeline import load_timeline
+from src.race.sector_stats import get_sector_times, get_stats
+from src.race.race_settings import RaceSettings, VisualizationSettings
 
-with open("config.json", "rb") as f:
-    config = json.load(f)
+timeline = None
+stats = None
+sector_data = None
 
-excluded_drivers = config["race_visualization"]["excluded_drivers"]
-sns.set_theme(style="white", rc={"axes.facecolor": (0, 0, 0, 0)})
-sector_dict = {}
 
-distribution_offset = {
-    1: config["race_visualization"]["distribution_offset"][0],
-    2: config["race_visualization"]["distribution_offset"][1],
-    3: config["race_visualization"]["distribution_offset"][2]
-}
+def set_theme():
+    sns.set_theme(style="white", rc={"axes.facecolor": (0, 0, 0, 0)})
 
-max_times = {
-    1: config["race_visualization"]["max_times"][0],
-    2: config["race_visualization"]["max_times"][1],
-    3: config["race_visualization"]["max_times"][2]
-}
 
-min_times = {
-    1: config["race_visualization"]["min_times"][0],
-    2: config["race_visualization"]["min_times"][1],
-    3: config["race_visualization"]["min_times"][2]
-}
+def create_sector_data(settings: VisualizationSettings):
+    # Long format DataFrame of every sector time: driver, sector, lap, time, the time relative to the
+    # driver's average in that sector and a "DRV (avg. 12.34)" label. Built once per loaded timeline.
+    global sector_data
+    if sector_data is not None:
+        return sector_data
+    if timeline is None or len(timeline) == 0:
+        raise Exception("Please load the sector timeline before creating a DataFrame")
 
-team_color = {k: v for d in config["teams"] for k, v in d.items()}
+    df = get_sector_times(timeline, settings)
+    average = stats["sectors"]["mean"].reindex(pd.MultiIndex.from_frame(df[["driver", "sector"]])).values
+    df["relative_time"] = df["time"] - average
+    df["label"] = df["driver"] + " (avg. " + pd.Series(average).round(2).astype(str) + ")"
 
+    sector_data = df
+    return df
 
-def create_sector_df(sector: int, group_laps=True, relative_times=False):
-    global sector_dict
-    if len(sector_dict) == 0:
-        raise Exception("Please load the sector dict before creating a DataFrame")
-
-    df = pd.DataFrame(index=np.arange(0, 1000))
-    grouped_sectors = []
-    global excluded_drivers
-    for driver in drivers.keys():
-        if driver not in excluded_drivers:
-            if group_laps:
-                grouped_sectors = [x[0] for x in groupby(sector_dict[driver][sector])]
-
-            df[driver] = pd.Series(grouped_sectors if group_laps else sector_dict[driver][sector])
-            df[driver] = df[driver].where(df[driver].between(min_times[sector], max_times[sector]))
-
-            if relative_times:
-                df[driver] = df[driver].apply(lambda x: x - df[driver].sum() / df[driver].count())
-
-            df[f"{driver} (avg. {round(df[driver].sum() / df[driver].count(), 2)})"] = df[driver]
-            df = df.drop([driver], axis=1)
-    df = df.dropna(0, how="all").reset_index(drop=True)
 
-    return df
+def get_sector_order(sector: int):
+    # Drivers with times in the sector, fastest average first (config order for equal averages)
+    means = stats["sectors"]["mean"].xs(sector, level="sector")
+    return means.reindex([driver for driver in drivers if driver in means.index]).sort_values(kind="mergesort").index
 
 
-def plot_driver_comparisons(to_compare: List[str]):
+def get_comparison_palette(to_compare: List[str]):
     if not all(x in drivers.keys() for x in to_compare):
         raise Exception("One or more of the drivers is not in the drivers list")
 
@@ -85,94 +66,147 @@ def plot_driver_comparisons(to_compare: List[str]):
     for i in range(len(palette)):
         if palette.count(palette[i]) > 1:
             palette[i] = custom_color(palette[i]) if len(palette) == 2 else random_color()
+    return palette
+
+
+def get_comparison_df(sector: int, to_compare: List[str], settings: VisualizationSettings):
+    data = create_sector_data(settings)
+    df = data[(data["sector"] == sector) & data["driver"].isin(to_compare)]
+    # One column of times without gaps per driver
+    df = df.assign(n=df.groupby("driver").cumcount()).pivot(index="n", columns="label", values="time")
+    # Reindex df to represent the color palette (sort by to_compare index)
+    df = df.reindex(sorted(df.columns, key=lambda c: to_compare.index(c[:3])), axis=1)
+    return df.rename_axis(index=None, columns=None)
+
+
+def draw_comparison(sector: int, df: pd.DataFrame, palette: list):
+    g = sns.relplot(data=df, kind="line", dashes=False, palette=palette)
+    g.set(ylabel="Time (s)")
+    return g.fig
+
+
+def get_densities(samples: List[np.ndarray], bw_adjust: float = .3, gridsize: int = 400, cut: float = 3):
+    # Gaussian KDE of every sample on one shared grid, with Scott's rule bandwidths like seaborn's kdeplot.
+    # All kernels are evaluated in one (points, grid) array and summed per sample.
+    bandwidths = np.array([np.std(x, ddof=1) * len(x) ** (-1 / 5) * bw_adjust for x in samples])
+    grid = np.linspace(min(x.min() for x in samples) - cut * bandwidths.max(),
+                       max(x.max() for x in samples) + cut * bandwidths.max(), gridsize)
+
+    points = np.concatenate(samples)
+    counts = np.array([len(x) for x in samples])
+    point_bandwidths = np.repeat(bandwidths, counts)[:, np.newaxis]
+    kernels = np.exp(-0.5 * ((grid - points[:, np.newaxis]) / point_bandwidths) ** 2) / point_bandwidths
+    densities = np.add.reduceat(kernels, np.concatenate([[0], np.cumsum(counts)[:-1]]), axis=0)
+    return grid, densities / (counts[:, np.newaxis] * np.sqrt(2 * np.pi))
+
+
+def get_distribution_data(sector: int, settings: VisualizationSettings):
+    # Labels sorted by average sector time, their colors and every label's times (starting with the
+    # distribution offset)
+    data = create_sector_data(settings)
+    df = data[data["sector"] == sector]
+    labels = list(df.drop_duplicates("driver").set_index("driver")["label"][get_sector_order(sector)])
+    times = df.groupby("label")["time"].apply(np.array)
+    samples = [np.concatenate([[settings.distribution_offset[sector]], times[label]]) for label in labels]
+    print(pd.Series(np.repeat(labels, [len(x) for x in samples]), name="driver").value_counts())
+    return labels, [drivers[x[:3]] for x in labels], samples
+
+
+def draw_distribution(sector: int, labels: list, palette: list, grid: np.ndarray, densities: np.ndarray):
+    # Same layout as a seaborn FacetGrid with one row per driver (aspect 15, height .5), but every density
+    # is drawn from the precomputed grid instead of being estimated again for every layer
+    fig, axes = plt.subplots(len(labels), 1, sharex=True, sharey=True, squeeze=False,
+                             figsize=(7.5, .5 * len(labels)))
+    for ax, label, color, density in zip(axes[:, 0], labels, palette, densities):
+        # Draw the densities in a few steps
+        ax.fill_between(grid, density, color=color, alpha=1, linewidth=1.5, clip_on=False)
+        ax.plot(grid, density, clip_on=False, color="w", lw=2)
+        ax.axhline(y=0, lw=2, clip_on=False, color=color)
+        ax.text(0, .5, label, fontweight="bold", color=color, ha="left", va="center", transform=ax.transAxes)
+
+        # Remove axes details that don't play well with overlap
+        ax.set_yticks([])
+        ax.set_ylabel("Density")
+        for side in ["top", "right", "left", "bottom"]:
+            ax.spines[side].set_visible(False)
+    axes[-1, 0].set_xlabel('Time (s)')
+
+    # Set the subplots to overlap
+    fig.subplots_adjust(hspace=-.25)
+    fig.suptitle(f"Sector {sector}", weight="bold")
+    return fig
 
+
+def plot_driver_comparisons(to_compare: List[str], race: RaceSettings):
+    palette = get_comparison_palette(to_compare)
     for sector in [1, 2, 3]:
-        df = create_sector_df(sector, group_laps=True)
-        # Reindex df to represent the color palette (sort by to_compare index)
-        df = df.reindex(sorted(df.columns, key=lambda c: to_compare.index(c[:3]) if c[:3] in to_compare else 100), axis=1)
-        df = df[df.columns[:len(to_compare)]]
-        for col in df.columns:
-            df[col] = df[col].dropna(0).reset_index(drop=True)
-
-        g = sns.relplot(data=df[[col for col in df.columns if any(x in col for x in to_compare)]],
-                        kind="line", dashes=False, palette=palette)
-        g.set(ylabel="Time (s)")
+        fig = draw_comparison(sector, get_comparison_df(sector, to_compare, race.visualization), palette)
         plt.show()
-        g.savefig(f"output/COMPARISON_S{sector}")
+        fig.savefig(os.path.join(race.output_dir, f"COMPARISON_S{sector}"), bbox_inches="tight")
 
 
-def plot_sector_distributions():
+def plot_sector_distributions(race: RaceSettings):
     for sector in [1, 2, 3]:
-        df = create_sector_df(sector, group_laps=True)
-
-        # Sort by average sector time
-        df = df.reindex(sorted(df.columns, key=lambda c: df[c].sum() / df[c].count()), axis=1)
-
-        # Reorganize data into new DataFrame
-        times = []
-        time_driver = []
-        for col in df.columns:
-            times.append(distribution_offset[sector])
-            time_driver.append(col)
-            for value in df[col].values:
-                times.append(value)
-                time_driver.append(col)
-
-        df2 = pd.DataFrame()
-        df2["times"] = pd.Series(times)
-        df2["driver"] = pd.Series(time_driver)
-        df2 = df2.dropna(0).reset_index(drop=True)
-        print(df2["driver"].value_counts())
-
-        # Initialize the FacetGrid object
-        palette = [drivers[x[:3]] for x in df.columns]
-        g = sns.FacetGrid(df2, row="driver", hue="driver", palette=palette, aspect=15, height=.5)
+        labels, palette, samples = get_distribution_data(sector, race.visualization)
+        fig = draw_distribution(sector, labels, palette, *get_densities(samples))
 
-        # Draw the densities in a few steps
-        g.map(sns.kdeplot, "times",
-              bw_adjust=.3, clip_on=False,
-              fill=True, alpha=1, linewidth=1.5)
-        g.map(sns.kdeplot, "times", clip_on=False, color="w", lw=2, bw_adjust=.3)
-        g.map(plt.axhline, y=0, lw=2, clip_on=False)
+        # Save and show the plot
+        fig.savefig(os.path.join(race.output_dir, f"DISTRIBUTION_S{sector}"), bbox_inches="tight")
+        plt.show()
 
-        # Define and use a simple function to label the plot in axes coordinates
-        def label(x, color, label):
-            ax = plt.gca()
-            ax.text(0, .5, label, fontweight="bold", color=color,
-                    ha="left", va="center", transform=ax.transAxes)
 
-        g.map(label, "times")
-        g.set_xlabels(f'Time (s)')
+def use_headless_backend():
+    set_theme()
+    plt.switch_backend("Agg")
 
-        # Set the subplots to overlap
-        g.fig.subplots_adjust(hspace=-.25)
 
-        g.fig.suptitle(f"Sector {sector}", weight="bold")
+def render_figure(draw, path: str, *args):
+    fig = draw(*args)
+    fig.savefig(path, bbox_inches="tight")
+    plt.close(fig)
+    return path
 
-        # Remove axes details that don't play well with overlap
-        g.set_titles("")
-        g.set(yticks=[])
-        g.despine(bottom=True, left=True)
 
-        # Save and show the plot
-        g.savefig(f"output/DISTRIBUTION_S{sector}")
-        plt.show()
+def render_figures(race: RaceSettings, to_compare: List[str] = None):
+    # Headless rendering: every figure is drawn and saved by a worker process with a non-interactive
+    # backend, nothing is shown
+    jobs = []
+    if to_compare:
+        palette = get_comparison_palette(to_compare)
+        jobs += [(draw_comparison, os.path.join(race.output_dir, f"COMPARISON_S{sector}"), sector,
+                  get_comparison_df(sector, to_compare, race.visualization), palette) for sector in [1, 2, 3]]
+    for sector in [1, 2, 3]:
+        labels, palette, samples = get_distribution_data(sector, race.visualization)
+        jobs.append((draw_distribution, os.path.join(race.output_dir, f"DISTRIBUTION_S{sector}"), sector, labels,
+                     palette, *get_densities(samples)))
 
+    render_workers = race.visualization.render_workers
+    if render_workers <= 1:
+        use_headless_backend()
+        return [render_figure(*job) for job in jobs]
+    with Pool(min(render_workers, len(jobs)), initializer=use_headless_backend) as pool:
+        return pool.starmap(render_figure, jobs)
 
-def visualize_data(to_compare: List[str] = None):
+
+def visualize_data(race: RaceSettings, to_compare: List[str] = None, headless: bool = False):
     try:
-        with open("output/sector_data", 'rb') as file:
-            global sector_dict
-            sector_dict = pickle.load(file)
+        global timeline, stats, sector_data
+        timeline = load_timeline(race.store_path)
+        stats = get_stats(race.store_path, race.visualization)
+        sector_data = None
+
+        global drivers
+        drivers = {driver: color for driver, color in race.visualization.driver_colors.items() if driver in timeline}
 
-            global drivers
-            drivers = {x["name"]: team_color[x["team"]] for x in config["drivers"]
-                       if x["name"] in sector_dict and len(sector_dict[x["name"]]) > 2}
+        if headless:
+            render_figures(race, to_compare)
+            return
 
-            if to_compare:
-                plot_driver_comparisons(to_compare)
+        set_theme()
+        if to_compare:
+            plot_driver_comparisons(to_compare, race)
 
-            plot_sector_distributions()
+        plot_sector_distributions(race)
 
     except FileNotFoundError as e:
         print("You need to gather and process the screenshots before visualizing")
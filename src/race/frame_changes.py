@@ -0,0 +1,64 @@
+import cv2
+import numpy as np
+from src.race.cell_grid import get_grid
+from src.race.metrics import get_metrics
+from src.race.race_settings import RaceSettings
+
+
+def get_thumbnail(image: np.ndarray, res_mul: float, block_size: int):
+    # Averages blocks of block_size pixels (at 720p), which evens out compression noise while a
+    # changed glyph still moves the blocks it covers by a lot
+    scale = 1 / (block_size * res_mul)
+    image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA).astype(np.int16)
+
+
+def get_change_score(previous: np.ndarray, current: np.ndarray):
+    # Largest block difference between two thumbnails, from 0 (identical) to 255
+    if previous.shape != current.shape:
+        return 255
+    return int(np.abs(current - previous).max())
+
+
+def get_cell_thumbnails(race: RaceSettings, image: np.ndarray, kind: str):
+    # One thumbnail per cell of a drivers or sectors crop, row by row, to tell which cells changed
+    grid = get_grid(kind, image.shape[0], image.shape[1], race.res_mul, race.drivers_on_grid, 1)
+    return [get_thumbnail(cell, race.res_mul, race.change_block_size) for cell in grid.raw_cells(image)]
+
+
+def get_changed_cells(race: RaceSettings, previous: list, current: list, cells):
+    return {cell for cell in cells if get_change_score(previous[cell], current[cell]) > race.change_threshold}
+
+
+class ChangeDetector:
+    # Compares every sample with the last one that was kept, so a change spread over several samples
+    # still adds up and gets through
+
+    def __init__(self, race: RaceSettings):
+        self.res_mul = race.res_mul
+        self.threshold = race.change_threshold
+        self.block_size = race.change_block_size
+        self.previous = None
+        self.dropped = 0
+
+    def is_changed(self, images):
+        thumbnails = [get_thumbnail(image, self.res_mul, self.block_size) for image in images]
+        if self.previous is not None and self.threshold > 0 and \
+                all(get_change_score(old, new) <= self.threshold for old, new in zip(self.previous, thumbnails)):
+            self.dropped += 1
+            return False
+
+        self.previous = thumbnails
+        return True
+
+
+def drop_unchanged(samples, detector: ChangeDetector):
+    # Yields the (sample, drivers, sectors) tuples whose crops changed
+    for sample in samples:
+        if detector.is_changed(sample[1:]):
+            yield sample
+        else:
+            get_metrics().count("samples.unchanged_dropped")
+
+    if detector.dropped > 0:
+        print(f"Skipped {detector.dropped} unchanged samples before OCR.")
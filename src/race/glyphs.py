@@ -0,0 +1,130 @@
+import os
+import numpy as np
+import cv2
+
+glyph_size = (16, 24)
+ink_threshold = 200
+
+
+def find_text_rows(cell: np.ndarray):
+    rows = np.flatnonzero((cell > ink_threshold).any(axis=1))
+    if len(rows) == 0:
+        return None
+    return rows[0], rows[-1] + 1
+
+
+def find_glyph_columns(cell: np.ndarray):
+    # Runs of columns that contain ink, as (start, end) pairs
+    columns = np.concatenate(([False], (cell > ink_threshold).any(axis=0), [False]))
+    edges = np.flatnonzero(np.diff(columns.astype(np.int8)))
+    return list(zip(edges[0::2], edges[1::2]))
+
+
+def segment_glyphs(cell: np.ndarray, max_aspect: float = None, typical_aspect: float = None):
+    # Splits a preprocessed cell into glyph images using column projections. All glyphs share the
+    # rows of the whole text line, so small glyphs like "." keep their position in the line.
+    text_rows = find_text_rows(cell)
+    if text_rows is None:
+        return []
+    top, bottom = text_rows
+    line_height = bottom - top
+
+    glyphs = []
+    for start, end in find_glyph_columns(cell):
+        if end - start < 2:
+            continue
+        # Glyphs that touch end up in one run, so split runs that are too wide for a single glyph
+        parts = 1
+        if max_aspect and typical_aspect and (end - start) / line_height > max_aspect * 1.25:
+            parts = max(1, round((end - start) / (typical_aspect * line_height)))
+        bounds = np.linspace(start, end, parts + 1).astype(int)
+        for part_start, part_end in zip(bounds[:-1], bounds[1:]):
+            glyphs.append(cell[top:bottom, part_start:part_end])
+    return glyphs
+
+
+def normalize_glyphs(glyphs: list):
+    if len(glyphs) == 0:
+        return np.zeros((0, glyph_size[0] * glyph_size[1]), np.float32)
+    return np.stack([cv2.resize((glyph > ink_threshold).astype(np.float32), glyph_size,
+                                interpolation=cv2.INTER_AREA).ravel() for glyph in glyphs])
+
+
+class GlyphClassifier:
+    # Nearest template classifier for the fixed timing tower font
+
+    def __init__(self, characters: np.ndarray, templates: np.ndarray, aspects: np.ndarray, spreads: np.ndarray):
+        self.characters = characters
+        self.templates = templates.astype(np.float32)
+        self.aspects = aspects
+        self.spreads = spreads
+        self.template_norms = (self.templates ** 2).sum(axis=1)
+
+    @classmethod
+    def load(cls, path: str):
+        bank = np.load(path)
+        return cls(bank["characters"], bank["templates"], bank["aspects"], bank["spreads"])
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.savez(path, characters=self.characters, templates=self.templates, aspects=self.aspects,
+                 spreads=self.spreads)
+
+    def recognize(self, cell: np.ndarray, whitelist: str):
+        # Returns the recognized text and a confidence between 0 (ambiguous) and 1 (exact template)
+        allowed = np.isin(self.characters, list(whitelist))
+        if allowed.sum() < 2:
+            return "", 0.0
+
+        glyphs = normalize_glyphs(segment_glyphs(cell, self.aspects[allowed].max(), np.median(self.aspects[allowed])))
+        if len(glyphs) == 0:
+            return "", 0.0
+
+        # Squared euclidean distance of every glyph to every allowed template in one go
+        templates = self.templates[allowed]
+        distances = (glyphs ** 2).sum(axis=1)[:, None] - 2 * glyphs @ templates.T + self.template_norms[allowed][None, :]
+        distances = np.maximum(distances, 0)
+        nearest = np.argsort(distances, axis=1)[:, :2]
+        best = np.take_along_axis(distances, nearest[:, :1], axis=1)[:, 0]
+        second = np.take_along_axis(distances, nearest[:, 1:], axis=1)[:, 0]
+
+        # A glyph is only certain when it is clearly closer to one template than to the others, and when it
+        # isn't far outside the variation seen for that character (e.g. a letter missing from the bank).
+        confidence = np.minimum(1 - best / np.maximum(second, 1e-6),
+                                1 - np.sqrt(best) / (4 * self.spreads[allowed][nearest[:, 0]] + 1))
+        text = "".join(self.characters[allowed][nearest[:, 0]])
+        return text, float(max(0.0, confidence.min()))
+
+
+def collect_glyphs(labelled_cells, samples: dict, max_aspect: float = None, typical_aspect: float = None):
+    unmatched = []
+    for cell, text in labelled_cells:
+        text_rows = find_text_rows(cell)
+        glyphs = segment_glyphs(cell, max_aspect, typical_aspect)
+        if text_rows is None or len(glyphs) != len(text):
+            unmatched.append((cell, text))
+            continue
+        line_height = text_rows[1] - text_rows[0]
+        for character, glyph, vector in zip(text, glyphs, normalize_glyphs(glyphs)):
+            samples.setdefault(character, []).append((vector, glyph.shape[1] / line_height))
+    return unmatched
+
+
+def build_classifier(labelled_cells):
+    # Averages the glyphs of cells whose text is known. Cells that don't segment into one glyph per
+    # character are retried with the glyph widths learned from the others, and skipped otherwise.
+    samples = {}
+    unmatched = collect_glyphs(labelled_cells, samples)
+    if len(samples) > 0:
+        aspects = [aspect for character in samples.values() for _, aspect in character]
+        collect_glyphs(unmatched, samples, max(aspects), float(np.median(aspects)))
+    if len(samples) == 0:
+        raise Exception("None of the labelled cells could be segmented into glyphs")
+
+    characters = sorted(samples.keys())
+    templates = np.stack([np.mean([vector for vector, _ in samples[c]], axis=0) for c in characters])
+    aspects = np.array([np.mean([aspect for _, aspect in samples[c]]) for c in characters])
+    spreads = np.array([np.sqrt(np.mean([((vector - template) ** 2).sum() for vector, _ in samples[c]]))
+                        for c, template in zip(characters, templates)])
+    counts = {c: len(samples[c]) for c in characters}
+    return GlyphClassifier(np.array(characters), templates, aspects, spreads), counts
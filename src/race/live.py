@@ -0,0 +1,198 @@
+import os
+import json
+import time
+import cv2
+import numpy as np
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from src.race.data_gathering import iterate_sample_frames, crop_frame, is_red_flag, in_background, get_video_fps
+from src.race.data_processing import process_screenshots, get_resume_frame
+from src.race.timeline import RaceTimeline
+from src.race.race_settings import RaceSettings
+from src.race.metrics import get_metrics, save_report
+
+
+class GrowingFileHandler(BaseHTTPRequestHandler):
+    # Sends a recording that is still being written as one endless response, so the video decoder keeps
+    # waiting for new frames at the end of the file instead of stopping. OpenCV can't seek in a file
+    # without a known length, so reopening the file would mean decoding it from the start again.
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.end_headers()
+        last_data = time.time()
+        idle_timeout = self.server.idle_timeout
+        with open(self.server.path, "rb") as file:
+            while time.time() - last_data < idle_timeout:
+                data = file.read(1 << 16)
+                if len(data) == 0:
+                    time.sleep(self.server.poll_interval / 10)
+                    continue
+                last_data = time.time()
+                try:
+                    self.wfile.write(data)
+                except ConnectionError:
+                    return
+        print(f"No new data in {self.server.path} for {idle_timeout}s, stopping.")
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_growing_file(path: str, poll_interval: float, idle_timeout: float):
+    # Serves the file on a free local port and returns the URL to open it as a stream
+    server = ThreadingHTTPServer(("127.0.0.1", 0), GrowingFileHandler)
+    server.path = path
+    server.poll_interval = poll_interval
+    server.idle_timeout = idle_timeout
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/"
+
+
+class LiveSource:
+    # Reads the sampled frames of a recording that is still being written, or of a stream endpoint
+    # (any path with "://"), and waits for new frames instead of stopping at the end of the file.
+    # With replay_speed, a finished recording is played back at that multiple of real time instead.
+
+    def __init__(self, race: RaceSettings, replay_speed: float = None, first_frame: int = 0):
+        self.race = race
+        self.replay_speed = replay_speed
+        self.first_frame = first_frame
+        self.is_stream = "://" in race.video_path
+        self.frames_per_second = get_video_fps(race.video_path)
+        if not self.frames_per_second:
+            raise Exception(f"Could not read the frame rate of {race.video_path}")
+        # Wall clock time at which frame 0 was live. A replay starts at its first sample, a recording or
+        # stream is live once reading a frame has to wait for it to be written.
+        self.start_time = None
+
+    def frame_offset(self, frame_index: int):
+        # Seconds from frame 0 until the frame is live
+        return frame_index / self.frames_per_second / (self.replay_speed or 1)
+
+    def frame_time(self, frame_index: int):
+        # Wall clock time at which the frame was recorded (or replayed)
+        return self.start_time + self.frame_offset(frame_index)
+
+    def open(self):
+        if self.replay_speed or self.is_stream:
+            return None, cv2.VideoCapture(self.race.video_path)
+        server, url = serve_growing_file(self.race.video_path, self.race.poll_interval, self.race.idle_timeout)
+        return server, cv2.VideoCapture(url)
+
+    def frames(self):
+        # Yields (frame index, frame) for every sampled frame, in the order they become available
+        sample_frames = iterate_sample_frames(self.race, self.frames_per_second)
+        next_sample = next(sample_frames)
+        while next_sample < self.first_frame:
+            next_sample = next(sample_frames)
+
+        # A stream can't be read from its start, so frames are counted from the first sample
+        position = next_sample if self.is_stream else 0
+        server, cap = self.open()
+        idle_since = None
+        # A decoded frame is a few milliseconds, waiting longer than two frames means waiting for the writer
+        live_wait = 2 / self.frames_per_second
+        try:
+            while True:
+                grab_start = time.time()
+                if not cap.grab():
+                    cap.release()
+                    if not self.is_stream:
+                        return
+                    # Reconnect to a stream that dropped, frames missed in between aren't counted
+                    if idle_since is None:
+                        idle_since = time.time()
+                    elif time.time() - idle_since > self.race.idle_timeout:
+                        print(f"No new frames from {self.race.video_path} for {self.race.idle_timeout}s, stopping.")
+                        return
+                    time.sleep(self.race.poll_interval)
+                    cap = cv2.VideoCapture(self.race.video_path)
+                    get_metrics().count("gathering.reconnects")
+                    continue
+
+                idle_since = None
+                get_metrics().count("gathering.frames_decoded")
+                if self.start_time is None and not self.replay_speed and time.time() - grab_start > live_wait:
+                    self.start_time = time.time() - self.frame_offset(position)
+                if position == next_sample:
+                    if self.start_time is None and self.replay_speed:
+                        self.start_time = time.time() - self.frame_offset(position)
+                    if self.replay_speed:
+                        time.sleep(max(0, self.frame_time(position) - time.time()))
+                    ret, frame = cap.retrieve()
+                    if ret:
+                        get_metrics().count("gathering.samples")
+                        yield position, frame
+                    next_sample = next(sample_frames)
+                position += 1
+        finally:
+            cap.release()
+            if server is not None:
+                server.shutdown()
+
+    def samples(self):
+        # (frame index, drivers, sectors) of every non red flag sample, decoded in a background thread
+        def crop():
+            for frame_index, frame in self.frames():
+                if not is_red_flag(frame, self.race.res_mul):
+                    yield frame_index, *crop_frame(frame, self.race.res_mul)
+                else:
+                    get_metrics().count("gathering.red_flag_drops")
+
+        return in_background(crop(), self.race.queue_size)
+
+
+class LivePublisher:
+    # Writes the laps of every driver to a snapshot file after every processed frame, together with the
+    # latency from the frame being recorded until its data was stored
+
+    def __init__(self, race: RaceSettings, source: LiveSource):
+        self.source = source
+        self.path = os.path.join(race.output_dir, race.snapshot_file)
+        # (frame index, wall clock time its data was stored), the latency is only known once the source
+        # knows when its frames were recorded
+        self.published = []
+
+    def __call__(self, frame_index: int, timeline: RaceTimeline):
+        self.published.append((frame_index, time.time()))
+        # Laps as [S1, S2, S3], with null for missed sectors
+        laps = {driver: [[None if np.isnan(t) else float(t) for t in lap] for lap in driver_laps]
+                for driver, driver_laps in timeline.get_laps().items()}
+
+        # Written next to the snapshot first, so a reader never sees a half written file
+        with open(self.path + ".tmp", "w") as file:
+            json.dump({
+                "frame": frame_index,
+                "timestamp": frame_index / self.source.frames_per_second,
+                "latency_stats": self.latency_stats(),
+                "laps": laps
+            }, file)
+        os.replace(self.path + ".tmp", self.path)
+
+    def latency_stats(self):
+        if len(self.published) == 0 or self.source.start_time is None:
+            return {}
+        frames, published = np.array(self.published).T
+        latencies = published - self.source.frame_time(frames)
+        return {"frames": len(latencies), "last": float(latencies[-1]), "median": float(np.median(latencies)),
+                "p95": float(np.percentile(latencies, 95)), "max": float(latencies.max())}
+
+
+def run_live(race: RaceSettings, replay_speed: float = None, resume: bool = False):
+    first_frame = get_resume_frame(race) if resume else 0
+    source = LiveSource(race, replay_speed, first_frame)
+    publisher = LivePublisher(race, source)
+    print(f"Following {race.video_path}, publishing to {publisher.path}")
+    try:
+        with get_metrics().timer("stage.live"):
+            process_screenshots(race, source.samples(), source.frames_per_second, resume, publish=publisher)
+    finally:
+        stats = publisher.latency_stats()
+        if stats:
+            print(f"Latency from frame to stored data: median {stats['median']:.2f}s, "
+                  f"95th percentile {stats['p95']:.2f}s, max {stats['max']:.2f}s over {stats['frames']} frames")
+        save_report(race.metrics_dir, {"video": race.video_path, "resume": resume, "replay_speed": replay_speed,
+                                       "latency": stats})
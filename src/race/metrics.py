@@ -0,0 +1,127 @@
+import os
+import json
+import time
+import threading
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+
+# Upper bounds of the latency histogram buckets in milliseconds, the last bucket holds everything slower
+latency_buckets = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000]
+metrics = None
+creation_lock = threading.Lock()
+
+
+class Metrics:
+    # Counters, timers and latency histograms of one process. Pool workers drain theirs with every result
+    # they send back (like the OCR cache statistics), so the main process ends up with the totals of a run.
+    # Stages count from several threads (e.g. the thread submitting samples to the pool while the main
+    # thread merges the results), so every access holds the lock.
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.counters = Counter()
+        self.timers = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def count(self, name: str, amount: int = 1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def add_time(self, name: str, seconds: float, histogram: bool = False):
+        with self.lock:
+            calls, total = self.timers.get(name, (0, 0.))
+            self.timers[name] = calls + 1, total + seconds
+            if histogram:
+                counts = self.histograms.setdefault(name, [0] * (len(latency_buckets) + 1))
+                counts[bisect_left(latency_buckets, seconds * 1000)] += 1
+
+    @contextmanager
+    def timer(self, name: str, histogram: bool = False):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start, histogram)
+
+    def drain(self):
+        # Everything since the last drain, as plain dicts that can be sent from a worker to the main process
+        with self.lock:
+            drained = dict(self.counters), dict(self.timers), \
+                {name: list(counts) for name, counts in self.histograms.items()}
+            self.counters, self.timers, self.histograms = Counter(), {}, {}
+        return drained
+
+    def merge(self, drained: tuple):
+        counters, timers, histograms = drained
+        with self.lock:
+            self.counters.update(counters)
+            for name, (calls, total) in timers.items():
+                previous_calls, previous_total = self.timers.get(name, (0, 0.))
+                self.timers[name] = previous_calls + calls, previous_total + total
+            for name, counts in histograms.items():
+                previous = self.histograms.setdefault(name, [0] * (len(latency_buckets) + 1))
+                self.histograms[name] = [a + b for a, b in zip(previous, counts)]
+
+    def report(self):
+        with self.lock:
+            counters, timers = dict(self.counters), dict(self.timers)
+            histograms = {name: list(counts) for name, counts in self.histograms.items()}
+        return {
+            "counters": dict(sorted(counters.items())),
+            "timers": {name: {"calls": calls, "total_sec": total, "mean_ms": total / max(1, calls) * 1000}
+                       for name, (calls, total) in sorted(timers.items())},
+            "histograms": {name: {"buckets_ms": latency_buckets + ["inf"], "counts": counts,
+                                  "p50_ms": get_percentile(counts, 50), "p95_ms": get_percentile(counts, 95),
+                                  "p99_ms": get_percentile(counts, 99)}
+                           for name, counts in sorted(histograms.items())}
+        }
+
+
+def get_percentile(counts: list, percentile: float):
+    # Upper bound of the bucket the percentile falls in, None when it's past the last bound
+    total = sum(counts)
+    if total == 0:
+        return None
+    cumulative = 0
+    for bound, count in zip(latency_buckets + [None], counts):
+        cumulative += count
+        if cumulative >= total * percentile / 100:
+            return bound
+    return None
+
+
+def reset_creation_lock():
+    global creation_lock
+    creation_lock = threading.Lock()
+
+
+# A pool can be forked while another thread holds a lock, which the child would wait on forever. Spawned
+# workers (Windows has no fork) start with fresh locks.
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reset_creation_lock)
+
+
+def get_metrics() -> Metrics:
+    # One instance per process. A forked pool worker starts with a copy of the parent's instance, which
+    # it replaces with an empty one so nothing is counted twice.
+    global metrics
+    with creation_lock:
+        if metrics is None or metrics.pid != os.getpid():
+            metrics = Metrics()
+    return metrics
+
+
+def save_report(directory: str, info: dict):
+    # Writes everything collected since the last report to <directory>/<date>-<time>.json
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, time.strftime("%Y%m%d-%H%M%S") + ".json")
+    # One drain, so nothing counted by another thread meanwhile is lost or reported twice
+    drained = Metrics()
+    drained.merge(get_metrics().drain())
+    report = drained.report()
+    with open(path, "w") as file:
+        json.dump({"info": info, **report}, file, indent=2)
+    print(f"Metrics report written to {path}")
+    return path
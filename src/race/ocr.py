@@ -0,0 +1,235 @@
+import os
+import hashlib
+import pickle
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+import numpy as np
+from PIL import Image
+from src.race.race_settings import OCRSettings
+
+tesseract_dir = r"C:\Program Files\Tesseract-OCR"
+loaded_backends = {}
+caches = {}
+
+
+class OCRBackend(ABC):
+    # Backends that can't read a whole panel at once make the panel OCR mode fall back to single cells
+    supports_panels = False
+
+    @abstractmethod
+    def image_to_string(self, image: np.ndarray, whitelist: str, page_segmentation: int = 8) -> str:
+        pass
+
+
+class PanelBackend(OCRBackend):
+    supports_panels = True
+
+    @abstractmethod
+    def image_to_data(self, image: np.ndarray, whitelist: str, page_segmentation: int = 11) -> dict:
+        # Word level results as lists under "text", "left", "top", "width", "height" and "conf"
+        pass
+
+
+class TesseractBackend(PanelBackend):
+    # Runs the tesseract executable through pytesseract, which starts a new process for every call
+
+    def __init__(self, settings: OCRSettings):
+        import pytesseract
+        self.pytesseract = pytesseract
+
+        tesseract_path = os.path.join(tesseract_dir, "tesseract.exe")
+        if os.path.exists(tesseract_path):
+            pytesseract.pytesseract.tesseract_cmd = tesseract_path
+        else:
+            print("WARNING: Could not find Tesseract-OCR 5.0.0 installation path.")
+
+    def image_to_string(self, image: np.ndarray, whitelist: str, page_segmentation: int = 8) -> str:
+        return self.pytesseract.image_to_string(
+            Image.fromarray(image),
+            lang='eng',
+            config=f'--psm {page_segmentation} --oem 3 -c tessedit_char_whitelist={whitelist}'
+        )
+
+    def image_to_data(self, image: np.ndarray, whitelist: str, page_segmentation: int = 11) -> dict:
+        data = self.pytesseract.image_to_data(
+            Image.fromarray(image),
+            lang='eng',
+            config=f'--psm {page_segmentation} --oem 3 -c tessedit_char_whitelist={whitelist}',
+            output_type=self.pytesseract.Output.DICT
+        )
+        return {key: data[key] for key in ["text", "left", "top", "width", "height", "conf"]}
+
+
+class TesserocrBackend(PanelBackend):
+    # Loads the tesseract engine once in this process through tesserocr and reuses it for every call
+
+    def __init__(self, settings: OCRSettings):
+        import tesserocr
+        self.tesserocr = tesserocr
+
+        tessdata_path = os.path.join(tesseract_dir, "tessdata")
+        if os.path.exists(tessdata_path):
+            self.api = tesserocr.PyTessBaseAPI(path=tessdata_path, lang='eng', oem=tesserocr.OEM.DEFAULT)
+        else:
+            self.api = tesserocr.PyTessBaseAPI(lang='eng', oem=tesserocr.OEM.DEFAULT)
+
+    def recognize(self, image: np.ndarray, whitelist: str, page_segmentation: int):
+        self.api.SetPageSegMode(page_segmentation)
+        self.api.SetVariable("tessedit_char_whitelist", whitelist)
+        self.api.SetImage(Image.fromarray(image))
+        self.api.Recognize()
+
+    def image_to_string(self, image: np.ndarray, whitelist: str, page_segmentation: int = 8) -> str:
+        self.recognize(image, whitelist, page_segmentation)
+        return self.api.GetUTF8Text()
+
+    def image_to_data(self, image: np.ndarray, whitelist: str, page_segmentation: int = 11) -> dict:
+        self.recognize(image, whitelist, page_segmentation)
+        data = {key: [] for key in ["text", "left", "top", "width", "height", "conf"]}
+        level = self.tesserocr.RIL.WORD
+        iterator = self.api.GetIterator()
+        if iterator is None:
+            return data
+
+        for word in self.tesserocr.iterate_level(iterator, level):
+            bounding_box = word.BoundingBox(level)
+            if bounding_box is None:
+                continue
+            left, top, right, bottom = bounding_box
+            data["text"].append(word.GetUTF8Text(level))
+            data["left"].append(left)
+            data["top"].append(top)
+            data["width"].append(right - left)
+            data["height"].append(bottom - top)
+            data["conf"].append(word.Confidence(level))
+        return data
+
+
+class TemplateBackend(OCRBackend):
+    # Matches the glyphs of a cell against a template bank of the timing tower font (see
+    # build_glyph_templates.py) and only asks the fallback backend when the match is ambiguous
+
+    def __init__(self, settings: OCRSettings):
+        from src.race.glyphs import GlyphClassifier
+        self.classifier = GlyphClassifier.load(settings.template_bank)
+        self.fallback = backends[settings.template_fallback](settings)
+        self.min_confidence = settings.template_min_confidence
+
+    def image_to_string(self, image: np.ndarray, whitelist: str, page_segmentation: int = 8) -> str:
+        text, confidence = self.classifier.recognize(image, whitelist)
+        if confidence < self.min_confidence:
+            return self.fallback.image_to_string(image, whitelist, page_segmentation)
+        return text
+
+
+backends = {
+    "tesseract": TesseractBackend,
+    "tesserocr": TesserocrBackend,
+    "template": TemplateBackend
+}
+
+
+def get_backend(settings: OCRSettings) -> OCRBackend:
+    # One backend per process (and settings), so every pool worker loads its engine once and keeps it
+    if settings.backend_key not in loaded_backends:
+        loaded_backends[settings.backend_key] = backends[settings.backend](settings)
+    return loaded_backends[settings.backend_key]
+
+
+class OCRCache:
+    # LRU cache of recognized text keyed on the binarized cell, so cells that didn't change since an
+    # earlier sample (or an earlier run when persisted) skip OCR entirely. Driver OCR looks cells up from the
+    # thread that submits the samples while the main thread merges the entries of the pool workers, so every
+    # access holds the lock.
+
+    def __init__(self, size: int, fingerprint: str):
+        self.size = size
+        self.fingerprint = fingerprint
+        self.entries = OrderedDict()
+        self.new_entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def key(self, cell: np.ndarray, whitelist: str, mode: str) -> bytes:
+        # mode is how the cell is read ("panel" or "cell"), which can give another text for the same cell
+        digest = hashlib.blake2b(f"{self.fingerprint}|{mode}|{whitelist}|{cell.shape}".encode(), digest_size=16)
+        digest.update(np.packbits(cell > 200).tobytes())
+        return digest.digest()
+
+    def get(self, key: bytes):
+        with self.lock:
+            text = self.entries.get(key)
+            if text is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return text
+
+    def put(self, key: bytes, text: str):
+        with self.lock:
+            self.new_entries[key] = text
+            self.add(key, text)
+
+    def merge(self, entries: dict):
+        with self.lock:
+            for key, text in entries.items():
+                self.add(key, text)
+
+    def add(self, key: bytes, text: str):
+        # Only called with the lock held
+        self.entries[key] = text
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def drain(self):
+        # Hits, misses and entries since the last drain, used to collect the caches of pool workers
+        with self.lock:
+            stats = self.hits, self.misses, self.new_entries
+            self.hits, self.misses, self.new_entries = 0, 0, {}
+        return stats
+
+    def load(self, path: str):
+        if os.path.exists(path):
+            with open(path, 'rb') as file:
+                self.merge(pickle.load(file))
+
+    def save(self, path: str):
+        with self.lock:
+            entries = dict(self.entries)
+        with open(path, 'wb') as file:
+            pickle.dump(entries, file)
+
+
+def get_fingerprint(settings: OCRSettings) -> str:
+    # Everything the recognized text depends on, so a persisted cache never returns the text of other
+    # settings or of a template bank that was built again since
+    fingerprint = repr(settings.backend_key)
+    if settings.backend == "template" and os.path.exists(settings.template_bank):
+        with open(settings.template_bank, 'rb') as file:
+            fingerprint += "|" + hashlib.blake2b(file.read(), digest_size=16).hexdigest()
+    return fingerprint
+
+
+def get_cache(settings: OCRSettings) -> OCRCache:
+    # One cache per process and settings, so a batch of races with different OCR settings never shares
+    # recognized text between backends and every cache is saved to its own race's cache_path
+    if settings.cache_key not in caches:
+        cache = OCRCache(settings.cache_size, get_fingerprint(settings))
+        if settings.cache_path:
+            cache.load(settings.cache_path)
+        caches[settings.cache_key] = cache
+    return caches[settings.cache_key]
+
+
+def reset_cache_locks():
+    for cache in caches.values():
+        cache.lock = threading.Lock()
+
+
+# Like the metrics lock, see src/race/metrics.py
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reset_cache_locks)
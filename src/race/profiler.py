@@ -0,0 +1,69 @@
+import os
+import sys
+import time
+import threading
+from collections import Counter
+
+
+class SamplingProfiler:
+    # Records the stack of the main thread (or of every thread) of this process every interval seconds from
+    # a background thread. Unlike cProfile it doesn't slow down the profiled code, so the numbers hold for a
+    # full race. The stacks are saved in the folded format that flamegraph.pl and speedscope read. Pool
+    # workers aren't sampled, their time shows up as the main process waiting on results (the metrics
+    # report has the time of their stages).
+
+    def __init__(self, interval: float = 0.01, all_threads: bool = False):
+        self.interval = interval
+        self.all_threads = all_threads
+        self.stacks = Counter()
+        self.samples = 0
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+
+    def run(self):
+        own_thread = threading.get_ident()
+        main_thread = threading.main_thread().ident
+        names = {}
+        while self.running:
+            time.sleep(self.interval)
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread or not (self.all_threads or thread_id == main_thread):
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def save(self, path: str):
+        with open(path, "w") as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f"{stack} {count}\n")
+        print(f"Profile of {self.samples} samples written to {path}")
+
+    def print_top(self, limit: int = 25):
+        # Functions by the share of samples they were on a stack in, with the time spent in their callees
+        # and blocking calls (e.g. waiting for OCR results from the pool). A function running on several
+        # threads at once can go over 100%.
+        inclusive = Counter()
+        for stack, count in self.stacks.items():
+            for function in set(stack.split(";")[1:]):
+                inclusive[function] += count
+        total = max(1, self.samples)
+        for function, count in inclusive.most_common(limit):
+            print(f"{count / total:6.1%}  {function}")
@@ -0,0 +1,123 @@
+import os
+import json
+from copy import deepcopy
+from functools import lru_cache
+
+config_path = "config.json"
+
+
+@lru_cache(maxsize=None)
+def read_config(path: str = config_path):
+    # Parsed once per process, callers copy it before changing anything (see merge_config)
+    with open(path, "rb") as f:
+        return json.load(f)
+
+
+def merge_config(base: dict, overrides: dict):
+    # Nested sections are merged key by key, anything else (e.g. the drivers list) is replaced
+    merged = deepcopy(base)
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_config(merged[key], value)
+        else:
+            merged[key] = deepcopy(value)
+    return merged
+
+
+class OCRSettings:
+    # The "ocr" section, everything a process needs to load its OCR backend and cache. Relative paths are
+    # inside the race's output directory, so every race of a batch keeps its own cache.
+
+    def __init__(self, section: dict, output_dir: str = "output"):
+        self.backend: str = section["backend"]
+        self.driver_whitelist: str = section["driver_whitelist"]
+        self.sector_whitelist: str = section["sector_whitelist"]
+        self.template_bank: str = os.path.join(output_dir, section["template_bank"])
+        self.template_fallback: str = section["template_fallback"]
+        self.template_min_confidence: float = section["template_min_confidence"]
+        self.cache_size: int = section["cache_size"]
+        self.cache_path: str = os.path.join(output_dir, section["cache_path"]) if section["cache_path"] else None
+
+    @property
+    def backend_key(self):
+        # Backends built from equal settings are interchangeable
+        return self.backend, self.template_bank, self.template_fallback, self.template_min_confidence
+
+    @property
+    def cache_key(self):
+        # Races with the same backend but another cache size or path keep a cache of their own
+        return self.backend_key, self.cache_size, self.cache_path
+
+
+class VisualizationSettings:
+    # The "race_visualization" section with the drivers and their team colors
+
+    def __init__(self, race_config: dict):
+        section = race_config["race_visualization"]
+        self.excluded_drivers: list = section["excluded_drivers"]
+        self.distribution_offset: dict = dict(zip([1, 2, 3], section["distribution_offset"]))
+        self.min_times: dict = dict(zip([1, 2, 3], section["min_times"]))
+        self.max_times: dict = dict(zip([1, 2, 3], section["max_times"]))
+        self.render_workers: int = section["render_workers"]
+        team_colors = {k: v for d in race_config["teams"] for k, v in d.items()}
+        self.driver_colors: dict = {x["name"]: team_colors[x["team"]] for x in race_config["drivers"]}
+
+
+class RaceSettings:
+    # Everything that can differ between race recordings, passed to the gathering, processing and
+    # visualization stages (and their pool workers) instead of living in module globals. The defaults come
+    # from config.json, overrides use the same layout, e.g. {"resolution": 720, "race_gathering": {"step": 10}}.
+
+    def __init__(self, video_path: str = "", overrides: dict = None, screenshots_dir: str = "screenshots",
+                 output_dir: str = "output", config: dict = None):
+        race_config = merge_config(config or read_config(), overrides or {})
+        self.video_path = video_path
+        self.screenshots_dir = screenshots_dir
+        self.output_dir = output_dir
+
+        self.resolution: int = race_config["resolution"]
+        self.res_mul: float = self.resolution / 720
+        self.drivers: list = [x["name"] for x in race_config["drivers"]]
+
+        gathering = race_config["race_gathering"]
+        self.step: float = gathering["step"]
+        self.start_offset: float = gathering["start_offset_min"] * 60
+        self.end_offset: float = gathering["end_offset_min"] * 60
+        self.sampling_schedule: str = gathering["sampling_schedule"]
+        self.min_interval: float = gathering["min_interval_sec"]
+        self.max_interval: float = gathering["max_interval_sec"]
+        self.bisect_resolution: float = gathering["bisect_resolution_sec"]
+        self.sampling_mode: str = gathering["sampling_mode"]
+        self.gathering_workers: int = gathering["workers"]
+        self.queue_size: int = gathering["queue_size"]
+        self.debug_screenshots: bool = gathering["debug_screenshots"]
+
+        processing = race_config["race_processing"]
+        self.drivers_on_grid: int = processing["drivers_on_grid"]
+        self.driver_retry_scales: list = processing["driver_retry_scales"]
+        self.processing_workers: int = processing["workers"]
+        self.ocr_mode: str = processing["ocr_mode"]
+        self.checkpoint_interval: float = processing["checkpoint_interval_sec"]
+
+        self.change_threshold: float = race_config["change_detection"]["threshold"]
+        self.change_block_size: int = race_config["change_detection"]["block_size"]
+
+        live = race_config["race_live"]
+        self.poll_interval: float = live["poll_interval_sec"]
+        self.idle_timeout: float = live["idle_timeout_sec"]
+        self.snapshot_file: str = live["snapshot_file"]
+
+        self.ocr = OCRSettings(race_config["ocr"], output_dir)
+        self.visualization = VisualizationSettings(race_config)
+
+    @property
+    def store_path(self):
+        return os.path.join(self.output_dir, "sector_store")
+
+    @property
+    def checkpoint_path(self):
+        return os.path.join(self.output_dir, "checkpoint")
+
+    @property
+    def metrics_dir(self):
+        return os.path.join(self.output_dir, "metrics")
@@ -0,0 +1,83 @@
+import os
+import json
+import pickle
+import hashlib
+import numpy as np
+import pandas as pd
+from src.race.sector_store import store_path, columns, get_column_path
+from src.race.timeline import RaceTimeline, load_timeline
+from src.race.race_settings import VisualizationSettings
+
+percentiles = [10, 25, 75, 90]
+stats_version = 1
+
+
+def get_sector_times(timeline: RaceTimeline, settings: VisualizationSettings):
+    # Long format DataFrame of every sector time in the min/max range: driver, sector, lap and time.
+    # Drivers are in config order, and excluded drivers are left out.
+    names = [driver for driver in settings.driver_colors if driver in timeline]
+    laps = [timeline[driver].get_laps() for driver in names]
+    lap_counts = np.array([len(driver_laps) for driver_laps in laps], dtype=int)
+    df = pd.DataFrame({
+        "driver": np.repeat(np.array(names, dtype=object), lap_counts * 3),
+        "sector": np.tile([1, 2, 3], lap_counts.sum()),
+        "lap": np.concatenate([np.repeat(np.arange(count), 3) for count in lap_counts] or [np.zeros(0, int)]),
+        "time": np.concatenate([driver_laps.ravel() for driver_laps in laps] or [np.zeros(0)])
+    })
+
+    # Missed sectors are NaN and fall outside every range
+    in_range = df["time"].between(df["sector"].map(settings.min_times), df["sector"].map(settings.max_times))
+    return df[in_range & ~df["driver"].isin(settings.excluded_drivers)].reset_index(drop=True)
+
+
+def build_stats(times: pd.DataFrame):
+    # "sectors" has count, mean, median, percentiles, best and standard deviation per (driver, sector),
+    # "gaps" the difference in mean time to every other driver, per (sector, driver)
+    grouped = times.groupby(["driver", "sector"])["time"]
+    sectors = grouped.agg(["count", "mean", "median", "min", "std"]).rename(columns={"min": "best"})
+    quantiles = grouped.quantile([p / 100 for p in percentiles]).unstack()
+    quantiles.columns = [f"p{p}" for p in percentiles]
+    sectors = sectors.join(quantiles)
+
+    means = sectors["mean"].unstack("sector")
+    gaps = pd.concat({sector: pd.DataFrame(np.subtract.outer(means[sector].values, means[sector].values),
+                                           index=means.index, columns=means.index)
+                      for sector in means.columns}, names=["sector", "driver"])
+    return {"sectors": sectors, "gaps": gaps}
+
+
+def get_stats_path(path: str = store_path):
+    # Next to the sector store
+    return os.path.join(os.path.dirname(path), "sector_stats")
+
+
+def get_data_hash(path: str, settings: VisualizationSettings):
+    # Changes with the sector store and with the settings that decide which times are counted
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(json.dumps([stats_version, settings.excluded_drivers, settings.min_times, settings.max_times,
+                              list(settings.driver_colors), percentiles]).encode())
+    for file_path in [os.path.join(path, "header.json")] + [get_column_path(path, column) for column in columns]:
+        with open(file_path, "rb") as file:
+            for chunk in iter(lambda: file.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_stats(path: str, settings: VisualizationSettings):
+    # Statistics of a sector store, read from disk unless the sector store changed since they were built
+    key = get_data_hash(path, settings)
+    stats_path = get_stats_path(path)
+    try:
+        with open(stats_path, "rb") as file:
+            stats = pickle.load(file)
+        if stats["key"] == key:
+            return stats
+    except FileNotFoundError:
+        pass
+
+    stats = build_stats(get_sector_times(load_timeline(path), settings))
+    stats["key"] = key
+    with open(stats_path + ".tmp", "wb") as file:
+        pickle.dump(stats, file)
+    os.replace(stats_path + ".tmp", stats_path)
+    return stats
@@ -0,0 +1,143 @@
+import os
+import json
+import pickle
+import numpy as np
+
+store_path = "output/sector_store"
+store_version = 1
+
+# One row per new sector time: the video frame it was read from, its time in the video, the driver
+# (index into the drivers in the header), the sector and the sector time
+columns = {
+    "frame": np.dtype(np.int64),
+    "timestamp": np.dtype(np.float64),
+    "driver": np.dtype(np.int16),
+    "sector": np.dtype(np.int8),
+    "time": np.dtype(np.float64)
+}
+
+
+def get_column_path(path: str, column: str):
+    return os.path.join(path, column + ".bin")
+
+
+def read_header(path: str):
+    with open(os.path.join(path, "header.json"), "r") as file:
+        header = json.load(file)
+    if header["version"] != store_version:
+        raise Exception(f"Unsupported sector store version {header['version']} in {path}")
+    return header
+
+
+def write_header(path: str, header: dict):
+    with open(os.path.join(path, "header.json"), "w") as file:
+        json.dump(header, file, indent=2)
+
+
+class SectorStoreWriter:
+    # Appends the sector times of every processed frame to the column files, so the store on disk is
+    # always complete up to the last written frame
+
+    def __init__(self, path: str = store_path, frames_per_second: float = None, append: bool = False,
+                 rows: int = None, drivers: list = None):
+        # When appending, rows cuts the store back to the rows written up to a checkpoint. drivers are the
+        # drivers known up front, others are added to the header when they first show up.
+        self.path = path
+        self.rows = 0
+        os.makedirs(path, exist_ok=True)
+        if append and os.path.exists(os.path.join(path, "header.json")):
+            self.header = read_header(path)
+            # Cut off a frame that was only partly written
+            self.rows = count_rows(path) if rows is None else min(rows, count_rows(path))
+            for column in columns:
+                with open(get_column_path(path, column), "r+b") as file:
+                    file.truncate(self.rows * columns[column].itemsize)
+        else:
+            self.header = {
+                "version": store_version,
+                "columns": {column: dtype.str for column, dtype in columns.items()},
+                "drivers": list(drivers or []),
+                "frames_per_second": frames_per_second
+            }
+            write_header(path, self.header)
+            for column in columns:
+                open(get_column_path(path, column), "wb").close()
+
+        self.driver_ids = {driver: i for i, driver in enumerate(self.header["drivers"])}
+        self.files = {column: open(get_column_path(path, column), "ab") for column in columns}
+
+    def get_driver_id(self, driver: str):
+        if driver not in self.driver_ids:
+            self.driver_ids[driver] = len(self.header["drivers"])
+            self.header["drivers"].append(driver)
+            write_header(self.path, self.header)
+        return self.driver_ids[driver]
+
+    def write(self, frame: int, sector_times: dict):
+        # sector_times is {driver: {sector: time}}, zero times aren't new times and are skipped
+        rows = [(self.get_driver_id(driver), sector, time) for driver, sectors in sector_times.items()
+                for sector, time in sectors.items() if time > 0]
+        if len(rows) == 0:
+            return
+
+        frames_per_second = self.header["frames_per_second"]
+        timestamp = frame / frames_per_second if frames_per_second else np.nan
+        drivers, sectors, times = zip(*rows)
+        data = {
+            "frame": np.full(len(rows), frame),
+            "timestamp": np.full(len(rows), timestamp),
+            "driver": np.array(drivers),
+            "sector": np.array(sectors),
+            "time": np.array(times)
+        }
+        for column, dtype in columns.items():
+            self.files[column].write(data[column].astype(dtype).tobytes())
+            self.files[column].flush()
+        self.rows += len(rows)
+
+    def close(self):
+        for file in self.files.values():
+            file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def count_rows(path: str):
+    # Rows every column has, a column can only be ahead when writing a frame was interrupted
+    return min(os.path.getsize(get_column_path(path, column)) // dtype.itemsize for column, dtype in columns.items())
+
+
+class SectorStore:
+    # Read only view of a sector store, the columns are memory-mapped instead of loaded
+
+    def __init__(self, path: str = store_path):
+        self.path = path
+        self.header = read_header(path)
+        self.drivers = self.header["drivers"]
+        rows = count_rows(path)
+        self.columns = {column: np.memmap(get_column_path(path, column), dtype=dtype, mode="r", shape=(rows,))
+                        if rows > 0 else np.zeros(0, dtype) for column, dtype in columns.items()}
+
+    def __len__(self):
+        return len(self.columns["frame"])
+
+    def __getitem__(self, column: str):
+        return self.columns[column]
+
+
+def convert_pickle(pickle_path: str, path: str = store_path, drivers: list = None):
+    # Converts a pickled {driver: {sector: [times]}} dict of older versions. The position in the list
+    # stands in for the frame, and timestamps are unknown.
+    with open(pickle_path, "rb") as file:
+        sector_dict = pickle.load(file)
+
+    frames = max((len(times) for sectors in sector_dict.values() for times in sectors.values()), default=0)
+    with SectorStoreWriter(path, drivers=drivers) as writer:
+        for frame in range(frames):
+            writer.write(frame, {driver: {sector: times[frame] for sector, times in sectors.items() if frame < len(times)}
+                                 for driver, sectors in sector_dict.items()})
+    return count_rows(path)
@@ -0,0 +1,113 @@
+import numpy as np
+from src.race.sector_store import SectorStore
+
+
+class DriverTimeline:
+    # Sector times of one driver aligned by lap: row i holds the S1, S2 and S3 of the driver's i-th lap
+    # (NaN where a sector was missed). The last time and lap of every sector are kept, so adding a time
+    # never has to look back through the earlier laps.
+
+    def __init__(self, capacity: int = 64):
+        self.times = np.full((capacity, 3), np.nan)
+        self.frames = np.full((capacity, 3), -1, np.int64)
+        self.laps = 0
+        self.last_times = [0., 0., 0.]
+        self.last_laps = [-1, -1, -1]
+
+    def get_lap(self, sector: int):
+        # A new time goes to the lap after this sector's last one, but never before the lap of an earlier
+        # sector or on a lap that already has a later sector
+        i = sector - 1
+        return max([self.last_laps[i] + 1] + self.last_laps[:i] + [lap + 1 for lap in self.last_laps[i + 1:]])
+
+    def add(self, frame: int, sector: int, time: float):
+        # Returns whether time is a new time, the timing tower keeps showing a time until the next one
+        if time <= 0 or time == self.last_times[sector - 1]:
+            return False
+
+        lap = self.get_lap(sector)
+        if lap >= len(self.times):
+            self.times = np.concatenate([self.times, np.full(self.times.shape, np.nan)])
+            self.frames = np.concatenate([self.frames, np.full(self.frames.shape, -1, np.int64)])
+        self.times[lap, sector - 1] = time
+        self.frames[lap, sector - 1] = frame
+        self.laps = max(self.laps, lap + 1)
+        self.last_times[sector - 1] = time
+        self.last_laps[sector - 1] = lap
+        return True
+
+    def get_laps(self):
+        # (laps, 3) array of sector times, NaN for missed sectors
+        return self.times[:self.laps]
+
+    def get_frames(self):
+        # (laps, 3) array of the frames the times were read from, -1 for missed sectors
+        return self.frames[:self.laps]
+
+    @classmethod
+    def from_rows(cls, frames: np.ndarray, sectors: np.ndarray, times: np.ndarray):
+        # The timeline that adding these new times one by one gives. The laps are then nondecreasing and a
+        # time starts a new lap exactly when its sector doesn't come after the sector of the time before.
+        laps = np.concatenate([[0], np.cumsum(sectors[1:] <= sectors[:-1])])
+        timeline = cls(int(laps[-1]) + 1)
+        timeline.times[laps, sectors - 1] = times
+        timeline.frames[laps, sectors - 1] = frames
+        timeline.laps = int(laps[-1]) + 1
+        for sector in [1, 2, 3]:
+            rows = np.flatnonzero(sectors == sector)
+            if len(rows) > 0:
+                timeline.last_times[sector - 1] = float(times[rows[-1]])
+                timeline.last_laps[sector - 1] = int(laps[rows[-1]])
+        return timeline
+
+
+class RaceTimeline:
+
+    def __init__(self):
+        self.drivers = {}
+
+    def __getitem__(self, driver: str):
+        return self.drivers[driver]
+
+    def __contains__(self, driver: str):
+        return driver in self.drivers
+
+    def __len__(self):
+        return len(self.drivers)
+
+    def merge(self, frame: int, sector_times: dict):
+        # sector_times is {driver: {sector: time}} as read from one frame. Times that were already added
+        # are set to 0 in place, which leaves only the new times of the frame.
+        for driver, sectors in sector_times.items():
+            timeline = self.drivers.get(driver) or DriverTimeline()
+            for sector, time in sectors.items():
+                if not timeline.add(frame, sector, time):
+                    sectors[sector] = 0
+            if timeline.laps > 0:
+                self.drivers[driver] = timeline
+        return sector_times
+
+    def get_laps(self):
+        return {driver: timeline.get_laps() for driver, timeline in self.drivers.items()}
+
+
+def load_timeline(path: str):
+    # Rebuilds the timeline from the store columns, grouped by driver in the order the rows were written.
+    # The store only holds new times, except for stores converted from pickles, whose repeated times are
+    # dropped like adding them would.
+    store = SectorStore(path)
+    drivers, sectors, times, frames = store["driver"], store["sector"].astype(np.int64), store["time"], store["frame"]
+    rows = np.flatnonzero(times > 0)
+    rows = rows[np.lexsort((sectors[rows], drivers[rows]))]
+    repeated = (drivers[rows][1:] == drivers[rows][:-1]) & (sectors[rows][1:] == sectors[rows][:-1]) & \
+        (times[rows][1:] == times[rows][:-1])
+    rows = np.sort(np.delete(rows, np.flatnonzero(repeated) + 1))
+    rows = rows[np.argsort(drivers[rows], kind="stable")]
+
+    timeline = RaceTimeline()
+    starts = np.flatnonzero(np.diff(drivers[rows], prepend=-1))
+    for start, end in zip(starts, np.append(starts[1:], len(rows))):
+        driver_rows = rows[start:end]
+        timeline.drivers[store.drivers[drivers[driver_rows[0]]]] = \
+            DriverTimeline.from_rows(frames[driver_rows], sectors[driver_rows], times[driver_rows])
+    return timeline
@@ -0,0 +1,55 @@
+import shutil
+
+import pytest
+
+import src.race.ocr as ocr
+from benchmarks.synthetic_race import generate_race
+from src.race.data_gathering import stream_screenshots, get_video_fps
+from src.race.data_processing import process_screenshots
+from src.race.race_settings import RaceSettings, merge_config
+from src.race.sector_store import SectorStore
+
+# Run from the repository root, RaceSettings reads config.json from there. The synthetic race is short, so
+# it's sampled more often than a real one.
+race_overrides = {"resolution": 720, "ocr": {"cache_path": None},
+                  "race_gathering": {"start_offset_min": 0.1, "end_offset_min": 0, "step": 5,
+                                     "sampling_schedule": "fixed"}}
+
+
+@pytest.fixture(scope="session")
+def synthetic_race(tmp_path_factory):
+    # Video path and ground truth of a two minute race with a red flag and pixel noise, rendered once
+    video_path = str(tmp_path_factory.mktemp("synthetic_race") / "race.mp4")
+    return video_path, generate_race(video_path, 720, 2, seed=1, red_flags=1, noise=4)
+
+
+@pytest.fixture
+def make_race(synthetic_race, tmp_path):
+    # RaceSettings of the synthetic race that write below the test's tmp_path, one directory per name
+    def make(name: str = "race", overrides: dict = None):
+        return RaceSettings(synthetic_race[0], merge_config(race_overrides, overrides or {}),
+                            str(tmp_path / name / "screenshots"), str(tmp_path / name / "output"))
+    return make
+
+
+@pytest.fixture
+def process_race():
+    # Processes a race straight from the video and returns its sector store as rows of
+    # (frame, timestamp, driver, sector, time)
+    if shutil.which("tesseract") is None:
+        pytest.skip("Tesseract isn't installed")
+
+    def process(race: RaceSettings, pool=None, first_frame: int = 0, resume: bool = False):
+        # Every run starts with an empty OCR cache, otherwise it would reuse what an earlier run read
+        ocr.caches.clear()
+        process_screenshots(race, stream_screenshots(race, False, first_frame, pool), get_video_fps(race.video_path),
+                            resume=resume, pool=pool)
+        return read_store(race)
+    return process
+
+
+def read_store(race: RaceSettings):
+    store = SectorStore(race.store_path)
+    return list(zip(store["frame"].tolist(), store["timestamp"].tolist(),
+                    [store.drivers[driver] for driver in store["driver"].tolist()], store["sector"].tolist(),
+                    store["time"].tolist()))
@@ -0,0 +1,50 @@
+from math import ceil, floor
+
+import numpy as np
+import pytest
+
+from benchmarks.synthetic_race import render_tower, get_shown
+from src.race.cell_grid import extract_cells, preprocess_image
+from src.race.data_gathering import FrameReader, crop_frame, get_video_samples, sample_frames
+
+
+def old_blank_cells(image: np.ndarray, kind: str, res_mul: float, rows: int, resize_scale: int):
+    # Which cells have ink the way parse_drivers and parse_sectors found them before the cell grid: the whole
+    # panel is preprocessed and split, and a cell has ink if a pixel is above 200
+    preprocessed = preprocess_image(image, resize_scale, contrast=True)
+    row_height = floor(21 * resize_scale * res_mul)
+    assert ceil(len(preprocessed) / row_height) == rows
+    cell_width = floor(70 * resize_scale * res_mul) if kind == "sectors" else preprocessed.shape[1]
+    columns = 3 if kind == "sectors" else 1
+    return [bool((preprocessed[row * row_height:(row + 1) * row_height if row < rows - 1 else None,
+                               column * cell_width:(column + 1) * cell_width] > 200).any())
+            for row in range(rows) for column in range(columns)]
+
+
+def assert_same_blank_cells(frame: np.ndarray, res_mul: float, rows: int, driver_scales: list):
+    drivers, sectors = crop_frame(frame, res_mul)
+    for image, kind, scales in [(drivers, "drivers", driver_scales), (sectors, "sectors", [4])]:
+        for resize_scale in scales:
+            _, _, cells_not_black = extract_cells(image, kind, res_mul, rows, resize_scale)
+            assert cells_not_black == old_blank_cells(image, kind, res_mul, rows, resize_scale), \
+                f"{kind} at scale {resize_scale}"
+
+
+def test_blank_cells_of_the_video(make_race):
+    race = make_race()
+    reader = FrameReader(race)
+    for _, frame in sample_frames(reader, get_video_samples(race)):
+        assert_same_blank_cells(frame, race.res_mul, race.drivers_on_grid, race.driver_retry_scales)
+    reader.release()
+
+
+@pytest.mark.parametrize("resolution", [720, 1080])
+@pytest.mark.parametrize("brightness", [255, 150, 100, 80, 60, 40])
+def test_blank_cells_of_dim_text(synthetic_race, make_race, resolution, brightness):
+    # Coloured times are darker than white ones in grayscale, e.g. purple is about 70
+    race = make_race(overrides={"resolution": resolution})
+    truth = synthetic_race[1]
+    for frame_index in range(0, truth["frames"], truth["frames"] // 8):
+        order, shown = get_shown(truth, frame_index)
+        frame = render_tower(order, shown, race.res_mul, False) // 255 * brightness
+        assert_same_blank_cells(frame, race.res_mul, race.drivers_on_grid, race.driver_retry_scales)
@@ -0,0 +1,81 @@
+import cv2
+import numpy as np
+import pytest
+
+import src.race.data_gathering as data_gathering
+from src.race.data_gathering import FrameReader, sample_frames, get_video_samples, iterate_video_samples
+
+
+def read_every_frame(video_path: str, step: float, start_offset: float):
+    # The gathering loop before frames were sought: every frame is read, the first one past the start offset
+    # and a full step is kept and then one every step + 1 frames
+    cap = cv2.VideoCapture(video_path)
+    frames_per_second = cap.get(cv2.CAP_PROP_FPS)
+    current_frame = 0
+    frame_index = 0
+    started = False
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        if current_frame > start_offset * frames_per_second or started:
+            started = True
+            if current_frame > step * frames_per_second:
+                current_frame = 0
+                yield frame_index, frame
+        current_frame += 1
+        frame_index += 1
+    cap.release()
+
+
+@pytest.mark.parametrize("mode", ["seek", "grab", "read"])
+def test_sampling_picks_the_frames_of_the_read_loop(make_race, mode):
+    race = make_race(overrides={"race_gathering": {"sampling_mode": mode}})
+    expected = list(read_every_frame(race.video_path, race.step, race.start_offset))
+
+    reader = FrameReader(race)
+    sampled = list(sample_frames(reader, get_video_samples(race)))
+    reader.release()
+
+    assert [frame_index for frame_index, _ in sampled] == [frame_index for frame_index, _ in expected]
+    for (frame_index, frame), (_, expected_frame) in zip(sampled, expected):
+        assert np.array_equal(frame, expected_frame), f"frame {frame_index} differs"
+
+
+def test_sampling_stops_at_the_end_offset(make_race):
+    race = make_race()
+    cap = cv2.VideoCapture(race.video_path)
+    end_frame = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) - 30 * round(cap.get(cv2.CAP_PROP_FPS))
+    cap.release()
+    samples = get_video_samples(race)
+    race.end_offset = 30
+
+    assert get_video_samples(race) == [frame_index for frame_index in samples if frame_index < end_frame]
+    assert data_gathering.get_video_range(race)[1] == end_frame
+
+
+def gather(race, first_frame: int = 0):
+    return [(frame_index, sample) for frame_index, sample in iterate_video_samples(race, first_frame)]
+
+
+def assert_same_samples(samples: list, expected: list):
+    assert [frame_index for frame_index, _ in samples] == [frame_index for frame_index, _ in expected]
+    for (frame_index, sample), (_, expected_sample) in zip(samples, expected):
+        # Red flag samples are None
+        assert (sample is None) == (expected_sample is None), f"frame {frame_index}"
+        if sample is not None:
+            assert all(np.array_equal(crop, expected_crop) for crop, expected_crop in zip(sample, expected_sample))
+
+
+def test_adaptive_schedule_resumes_on_the_same_frames(make_race, monkeypatch):
+    # Several adaptive segments in the short race, so the resumed run starts over in the middle of one
+    monkeypatch.setattr(data_gathering, "adaptive_segment_seconds", 30)
+    race = make_race(overrides={"race_gathering": {"sampling_schedule": "adaptive", "workers": 1}})
+    samples = gather(race)
+    assert len(samples) > 10
+
+    pooled = make_race(overrides={"race_gathering": {"sampling_schedule": "adaptive", "workers": 3}})
+    assert_same_samples(gather(pooled), samples)
+    for resumed_sample in [len(samples) // 3, len(samples) // 2]:
+        first_frame = samples[resumed_sample][0] + 1
+        assert_same_samples(gather(race, first_frame), samples[resumed_sample + 1:])
@@ -0,0 +1,72 @@
+import pytest
+
+import src.race.data_gathering as data_gathering
+import src.race.data_processing as data_processing
+from src.race.data_processing import get_resume_frame, check_almost_equal
+from src.race.sector_store import count_rows
+
+
+def test_small_differences_count_as_new_times_only_in_changed_cells():
+    previous = [{1: 21.5, 2: 30.1, 3: 0}, {1: 22.0, 2: 0, 3: 0}]
+    current = [{1: 21.5, 2: 30.7, 3: 0}, {1: 22.0, 2: 0, 3: 0}]
+
+    assert check_almost_equal(previous, current)
+    assert check_almost_equal(previous, current, changed_cells={(1, 2)})
+    assert not check_almost_equal(previous, current, changed_cells={(0, 2)})
+
+
+def test_pool_gives_the_serial_output(make_race, process_race):
+    serial = process_race(make_race("serial", {"race_gathering": {"workers": 1},
+                                               "race_processing": {"workers": 1}}))
+    pooled = process_race(make_race("pooled", {"race_gathering": {"workers": 3},
+                                               "race_processing": {"workers": 3}}))
+
+    assert len(serial) > 0
+    assert pooled == serial
+
+
+class Interrupted(Exception):
+    pass
+
+
+def interrupt(monkeypatch, frames: int, checkpoints: int):
+    # Stops processing before its frames-th frame, with only the first checkpoints checkpoints saved, so the
+    # store has rows past the last checkpoint like after a crash
+    parse_frames = data_processing.parse_frames
+    save_checkpoint = data_processing.save_checkpoint
+    saved = []
+
+    def interrupted_frames(samples, race, pool=None):
+        for i, result in enumerate(parse_frames(samples, race, pool)):
+            if i == frames:
+                raise Interrupted()
+            yield result
+
+    def save_first_checkpoints(state: dict, path: str):
+        if len(saved) < checkpoints:
+            saved.append(state["rows"])
+            save_checkpoint(state, path)
+
+    monkeypatch.setattr(data_processing, "parse_frames", interrupted_frames)
+    monkeypatch.setattr(data_processing, "save_checkpoint", save_first_checkpoints)
+    return saved
+
+
+@pytest.mark.parametrize("schedule", ["fixed", "adaptive"])
+def test_resumed_run_gives_the_uninterrupted_store(make_race, process_race, monkeypatch, schedule):
+    # Several adaptive segments in the short race, so a resume starts over in the middle of the race
+    monkeypatch.setattr(data_gathering, "adaptive_segment_seconds", 30)
+    overrides = {"race_gathering": {"sampling_schedule": schedule, "workers": 1},
+                 "race_processing": {"workers": 1, "checkpoint_interval_sec": 0}}
+    uninterrupted = process_race(make_race("uninterrupted", overrides))
+
+    race = make_race("resumed", overrides)
+    with monkeypatch.context() as interrupted:
+        saved = interrupt(interrupted, 8, 4)
+        with pytest.raises(Interrupted):
+            process_race(race)
+    # The rows written after the last checkpoint are dropped on resume
+    assert saved[-1] < count_rows(race.store_path)
+    resumed = process_race(race, first_frame=get_resume_frame(race), resume=True)
+
+    assert resumed == uninterrupted
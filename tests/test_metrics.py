@@ -0,0 +1,11 @@
+import importlib
+import os
+import sys
+
+
+def test_modules_import_without_fork(monkeypatch):
+    # Windows has no os.register_at_fork
+    monkeypatch.delattr(os, "register_at_fork")
+    for name in ["src.race.metrics", "src.race.ocr"]:
+        monkeypatch.delitem(sys.modules, name, raising=False)
+        importlib.import_module(name)
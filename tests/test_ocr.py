@@ -0,0 +1,32 @@
+import numpy as np
+
+from src.race.ocr import OCRCache, PanelBackend, backends, get_fingerprint
+from src.race.race_settings import RaceSettings
+
+
+def get_key(settings, mode: str = "cell"):
+    cell = np.zeros((84, 280), np.uint8)
+    cell[20:60, 30:200] = 255
+    return OCRCache(10, get_fingerprint(settings)).key(cell, "0123456789.", mode)
+
+
+def test_cache_keys_change_with_what_the_text_depends_on(tmp_path):
+    bank = tmp_path / "glyph_templates.npz"
+    bank.write_bytes(b"first bank")
+    template = {"backend": "template", "template_bank": str(bank)}
+    race = RaceSettings(overrides={"ocr": template})
+    key = get_key(race.ocr)
+
+    assert get_key(RaceSettings(overrides={"ocr": template}).ocr) == key
+    assert get_key(race.ocr, "panel") != key
+    assert get_key(RaceSettings(overrides={"ocr": dict(template, template_min_confidence=0.5)}).ocr) != key
+    assert get_key(RaceSettings(overrides={"ocr": dict(template, template_fallback="tesserocr")}).ocr) != key
+    assert get_key(RaceSettings(overrides={"ocr": {"backend": "tesseract"}}).ocr) != key
+    bank.write_bytes(b"rebuilt bank")
+    assert get_key(race.ocr) != key
+
+
+def test_only_panel_backends_read_panels():
+    for backend in backends.values():
+        assert backend.supports_panels == issubclass(backend, PanelBackend)
+    assert not backends["template"].supports_panels
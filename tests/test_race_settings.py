@@ -0,0 +1,16 @@
+import os
+
+from src.race.race_settings import RaceSettings
+
+
+def test_relative_ocr_paths_are_inside_the_output_dir(tmp_path):
+    first = RaceSettings(output_dir=os.path.join("batch", "first", "output"))
+    second = RaceSettings(output_dir=os.path.join("batch", "second", "output"))
+    assert first.ocr.cache_path == os.path.join("batch", "first", "output", "ocr_cache")
+    assert first.ocr.template_bank == os.path.join("batch", "first", "output", "glyph_templates.npz")
+    assert first.ocr.cache_key != second.ocr.cache_key
+
+    shared = str(tmp_path / "ocr_cache")
+    races = [RaceSettings(output_dir=name, overrides={"ocr": {"cache_path": shared}}) for name in ["a", "b"]]
+    assert [race.ocr.cache_path for race in races] == [shared, shared]
+    assert RaceSettings(overrides={"ocr": {"cache_path": None}}).ocr.cache_path is None
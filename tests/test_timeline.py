@@ -0,0 +1,74 @@
+import numpy as np
+
+from src.race.sector_store import SectorStoreWriter
+from src.race.timeline import DriverTimeline, RaceTimeline, load_timeline
+
+
+def get_truth_laps(truth: dict):
+    # {driver: (times, frames)} of the synthetic race, (laps, 3) arrays of every lap's S1, S2 and S3 and the
+    # frames they appeared on (NaN and -1 for sectors after the end). Every driver starts with S1.
+    laps = {}
+    for frame, driver, sector, sector_time in truth["times"]:
+        times, frames = laps.setdefault(driver, ([], []))
+        if sector == 1:
+            times.append([np.nan] * 3)
+            frames.append([-1] * 3)
+        times[-1][sector - 1] = sector_time
+        frames[-1][sector - 1] = frame
+    return {driver: (np.array(times), np.array(frames)) for driver, (times, frames) in laps.items()}
+
+
+def test_missed_sectors_stay_on_their_lap(synthetic_race):
+    for driver, (truth_times, _) in get_truth_laps(synthetic_race[1]).items():
+        timeline = DriverTimeline(capacity=1)
+        # Every third time is missed, e.g. behind a red flag or between two samples
+        kept = [(lap, sector) for i, (lap, sector) in enumerate(zip(*np.nonzero(~np.isnan(truth_times))))
+                if i % 3 != 1]
+        added = sum(timeline.add(frame, sector + 1, truth_times[lap, sector])
+                    for frame, (lap, sector) in enumerate(kept))
+
+        times = timeline.get_laps()
+        read = ~np.isnan(times)
+        assert timeline.laps == kept[-1][0] + 1
+        assert np.array_equal(times[read], truth_times[read])
+        assert read.sum() == added
+
+
+def test_processed_timeline_is_lap_aligned(synthetic_race, make_race, process_race):
+    race = make_race(overrides={"race_gathering": {"workers": 1}, "race_processing": {"workers": 1}})
+    process_race(race)
+    timeline = load_timeline(race.store_path)
+
+    truth_laps = get_truth_laps(synthetic_race[1])
+    assert set(timeline.drivers) == set(truth_laps)
+    for driver, driver_timeline in timeline.drivers.items():
+        truth_frames = truth_laps[driver][1]
+        frames = driver_timeline.get_frames()
+        # Every time is on the row of the lap that was on screen when it was read, whether or not OCR read
+        # it right
+        for lap, sector in zip(*np.nonzero(frames >= 0)):
+            appeared = truth_frames[:, sector][truth_frames[:, sector] >= 0]
+            assert np.searchsorted(appeared, frames[lap, sector], side="right") - 1 == lap, \
+                f"{driver} S{sector + 1} read on frame {frames[lap, sector]} is on lap {lap}"
+
+
+def test_loaded_timeline_is_the_added_one(tmp_path):
+    # Random reads with missed sectors, repeated times (as in converted stores) and a driver who shows up late
+    rng = np.random.default_rng(1)
+    path = str(tmp_path / "sector_store")
+    added = RaceTimeline()
+    with SectorStoreWriter(path, 25, drivers=["HAM", "VER", "BOT"]) as writer:
+        for frame in range(400):
+            driver = ["HAM", "VER", "BOT"][rng.integers(3 if frame > 100 else 2)]
+            sector = int(rng.integers(1, 4))
+            time = float(rng.choice([21.5, 30.25, rng.uniform(20, 35)]))
+            writer.write(frame, {driver: {sector: time}})
+            added.drivers.setdefault(driver, DriverTimeline()).add(frame, sector, time)
+
+    loaded = load_timeline(path)
+    assert set(loaded.drivers) == set(added.drivers)
+    for driver, timeline in added.drivers.items():
+        assert np.array_equal(loaded[driver].get_laps(), timeline.get_laps(), equal_nan=True)
+        assert np.array_equal(loaded[driver].get_frames(), timeline.get_frames())
+        assert loaded[driver].last_times == timeline.last_times
+        assert loaded[driver].last_laps == timeline.last_laps